@@ -29,6 +29,8 @@
                       depth.
     cthick()       -- Image transformation by conditional thickening.
     cthin()        -- Image transformation by conditional thinning.
+    ComponentTree  -- Component tree (max-tree or min-tree) of a gray-scale
+                      image.
     cwatershed()   -- Detection of watershed from markers.
     datatype()     -- Return the image datatype string
     dilate()       -- Dilate an image by a structuring element.
@@ -80,6 +82,7 @@
     openrecth()    -- Open-by-Reconstruction Top-Hat.
     openth()       -- Opening Top Hat.
     opentransf()   -- Open transform.
+    PackedBinary   -- Bit-packed binary image.
     pad4n()        -- pad4n
     patspec()      -- Pattern spectrum (also known as granulometric size
                       density).
@@ -334,21 +337,30 @@ def close_holes(f, Bc=None):
     return y
 
 
-def dist(f, Bc=None, METRIC=None):
+def dist(f, Bc=None, METRIC=None, INDEX=None, LABELS=None):
     """
         - Purpose
             Distance transform.
         - Synopsis
-            y = dist(f, Bc=None, METRIC=None)
+            y = dist(f, Bc=None, METRIC=None, INDEX=None, LABELS=None)
         - Input
             f:      Binary image.
             Bc:     Structuring Element Default: None (3x3 elementary
                     cross). (connectivity)
             METRIC: String Default: None. 'EUCLIDEAN', or 'EUC2' for squared
                     Euclidean.
+            INDEX:  String Default: None. 'FLAT' or 'COORD' to also return
+                    the nearest point of the complement of f . Euclidean
+                    metrics only.
+            LABELS: Gray-scale (uint8 or uint16) image. Default: None. If
+                    given, also return the value of LABELS at the nearest
+                    point of the complement of f . Euclidean metrics only.
         - Output
             y: distance image in uint16, or in int32 datatype with EUC2
-               option.
+               option. With INDEX , the tuple (y, i) where i is the int32
+               flat index ('FLAT') or the pair of int32 row and column
+               images ('COORD') of the nearest point. With LABELS , the
+               nearest label image is appended to the tuple.
         - Description
             dist creates the distance image y of the binary image f . The
             value of y at the pixel x is the distance of x to the complement
@@ -356,8 +368,19 @@ def dist(f, Bc=None, METRIC=None):
             complement of f . The distances available are based on the
             Euclidean metrics and on metrics generated by a a regular graph,
             that is characterized by a connectivity rule defined by the
-            structuring element Bc . The implementation of the Euclidean
-            algorithm is based on LotuZamp:01 .
+            structuring element Bc . The Euclidean distance is exact and
+            computed in linear time, with a column pass followed by a lower
+            envelope of parabolas along the rows (Meijster, Roerdink and
+            Hesselink). 'EUCLIDEAN' rounds the distance to the nearest
+            integer. Pixels of an image with no background get the maximum
+            of the output datatype. The other metrics are chamfer distances
+            computed by raster and anti-raster passes: unit steps along the
+            offsets of a flat Bc , or steps costing -Bc(x) for a non-flat
+            (int32) Bc , saturated at 65535. The nearest point of INDEX and
+            LABELS comes from the same Euclidean pass; with LABELS set to
+            the labelled markers of the complement of f , it gives their
+            zones of influence. Ties go to any of the nearest points. An
+            image with no background gets the index -1 and the label 0.
         - Examples
             #
             #   example 1
@@ -378,44 +401,195 @@ def dist(f, Bc=None, METRIC=None):
             show(d4%8)
             show(d8%8)
             show(de%8)
+            #
+            #   example 3
+            #
+            m = label(binary([
+             [0,0,0,0,0,0,0],
+             [0,1,0,0,0,0,0],
+             [0,0,0,0,0,1,0],
+             [0,0,0,0,0,0,0]]))
+            d,i,z = dist(neg(m>0),sebox(),'EUC2','COORD',m)
     """
     from string import upper
     import numpy
-    from numpy import zeros, sqrt
+    from numpy import zeros, sqrt, asarray, where
     if Bc is None: Bc = secross()
     if METRIC is not None:
        METRIC = upper(METRIC)
-    f = gray(f,'uint16')
-    y = intersec(f,0)
+    if INDEX is not None:
+       INDEX = upper(INDEX)
+       assert INDEX in ['FLAT','COORD'],'INDEX should be FLAT or COORD'
+    if (INDEX is not None) or (LABELS is not None):
+        assert METRIC in ['EUCLIDEAN','EUC2'],'INDEX and LABELS need the EUCLIDEAN or EUC2 metric'
     if (METRIC == 'EUCLIDEAN') or (METRIC == 'EUC2'):
-        b = zeros((3,3),numpy.int32)
-        i=1
-        while not isequal(f,y):
-            a4,a2 = -4*i+2, -2*i+1
-            b = to_int32([[a4,a2,a4],
-                       [a2, 0,a2],
-                       [a4,a2,a4]])
-            y=f
-            i+=1
-            f = erode(f,b)
-        if METRIC == 'EUCLIDEAN':
-            f = to_uint16(sqrt(f)+0.5)
+        d2,r,c = _edt(f, 1)
+        if METRIC == 'EUC2':
+            y = to_int32(d2)
+            y[d2 < 0] = limits(y)[1]
+        else:
+            y = to_uint16(sqrt(d2.clip(0))+0.5)
+            y[d2 < 0] = limits(y)[1]
+        if (INDEX is None) and (LABELS is None): return y
+        y = [y]
+        if INDEX == 'FLAT':
+            y.append(to_int32(where(d2 < 0, -1, r*d2.shape[1] + c)))
+        elif INDEX == 'COORD':
+            y.append((to_int32(where(d2 < 0, -1, r)), to_int32(where(d2 < 0, -1, c))))
+        if LABELS is not None:
+            LABELS = asarray(LABELS)
+            z = LABELS.reshape(d2.shape)[r,c]
+            z[d2 < 0] = 0
+            y.append(z)
+        return tuple(y)
+    if isbinary(Bc) or isequal(Bc, secross()) or isequal(Bc, sebox()):
+        x,v = mat2set(binary(Bc))
+        x = [(dr,dc) for dr,dc in x if dr or dc] + [(0,0)]
+        c = [1]*(len(x)-1) + [0]
     else:
-        if isequal(Bc, secross()):
-            b = to_int32([[-2147483647,  -1, -2147483647],
-                       [         -1,   0,          -1],
-                       [-2147483647,  -1, -2147483647]])
-        elif isequal(Bc, sebox()):
-            b = to_int32([[-1,-1,-1],
-                       [-1, 0,-1],
-                       [-1,-1,-1]])
-        else: b = Bc
-        while not isequal(f,y):
-            y=f
-            f = erode(f,b)
+        x,v = mat2set(Bc)
+        c = [-int(vi) for vi in v]
+    steps = [(dr,dc,ci) for (dr,dc),ci in zip(x,c) if dr or dc]
+    origin = [ci for (dr,dc),ci in zip(x,c) if not (dr or dc)]
+    if origin == [0] and min([ci for dr,dc,ci in steps] + [0]) >= 0:
+        exact = isequal(Bc, secross()) or isequal(Bc, sebox())
+        return to_uint16(_chamfer(f, steps, 65535, exact))
+    f = gray(f,'uint16')           # negative steps: iterate the erosion
+    y = intersec(f,0)
+    while not isequal(f,y):
+        y=f
+        f = erode(f,Bc)
     return y
 
 
+def _chamfer(f, steps, inf, exact=False):
+    """
+    y = _chamfer(f, steps, inf, exact=False)
+
+    Chamfer distance y(q) = min(inf, min over steps (dr,dc,c) of
+    y(q+(dr,dc)) + c), with y = 0 on the 0 pixels of the binary image f
+    and inf outside it. Rows are swept down with the steps that look back
+    in raster order and up with the others, each row at once; steps
+    along the row are a running minimum. The sweeps repeat until nothing
+    changes, or run once if exact.
+    """
+    from numpy import asarray, newaxis, where, arange, minimum
+    f = asarray(f)
+    if len(f.shape) == 1: f = f[newaxis,:]
+    h,w = f.shape
+    y = where(f != 0, inf, 0).astype(int)
+    back = [(dr,dc,c) for dr,dc,c in steps if dr < 0 or (dr == 0 and dc < 0)]
+    ahead = [(-dr,-dc,c) for dr,dc,c in steps if dr > 0 or (dr == 0 and dc > 0)]
+    while True:
+        y0 = y.copy()
+        for st,rows in [(back, xrange(h)), (ahead, xrange(h-1,-1,-1))]:
+            flip = (st is ahead) and -1 or 1
+            inrow = [(-dc,c) for dr,dc,c in st if dr == 0]
+            for i in rows:
+                a = y[i]
+                for dr,dc,c in st:
+                    k = i + flip*dr
+                    if dr == 0 or not 0 <= k < h: continue
+                    _shiftmin(a, y[k], flip*dc, c)
+                if inrow:
+                    y[i] = _rowchamfer(a[::flip], inrow, inf)[::flip]
+        if exact or (y == y0).all(): return y
+        exact = False
+
+
+def _shiftmin(a, b, dc, c):
+    """
+    _shiftmin(a, b, dc, c)
+
+    In place a[j] = min(a[j], b[j+dc] + c) where j+dc falls inside b.
+    """
+    from numpy import minimum
+    w = len(a)
+    if dc >= 0: minimum(a[:w-dc], b[dc:] + c, a[:w-dc])
+    else:       minimum(a[-dc:], b[:w+dc] + c, a[-dc:])
+
+
+def _rowchamfer(a, steps, inf):
+    """
+    y = _rowchamfer(a, steps, inf)
+
+    y[j] = min(a[j], min over steps (k,c) of y[j-k] + c), capped at inf.
+    A single unit step that no other step beats is a running minimum;
+    otherwise the shifts repeat until they stop improving.
+    """
+    from numpy import arange, minimum
+    c1 = [c for k,c in steps if k == 1]
+    if c1 and min([c - k*c1[0] for k,c in steps]) >= 0:
+        j = c1[0]*arange(len(a))
+        return minimum(minimum.accumulate(a - j) + j, inf)
+    y = a.copy()
+    while True:
+        y0 = y.copy()
+        for k,c in steps:
+            _shiftmin(y, y.copy(), -k, c)
+        if (y == y0).all(): return minimum(y, inf)
+
+
+def _edt(f, index=False):
+    """
+    d2 = _edt(f, index=False)
+
+    Exact squared Euclidean distance from each pixel of the binary image f
+    to the nearest 0 pixel, or -1 everywhere when f has no 0 pixel. The
+    column distances come from running extrema of the background rows;
+    the rows then take the lower envelope of the parabolas (Meijster,
+    Roerdink and Hesselink), vectorised across the rows. With index , it
+    returns (d2, r, c) where (r, c) is the nearest 0 pixel.
+    """
+    from numpy import asarray, newaxis, arange, where, maximum, minimum, zeros, empty
+    f = asarray(f)
+    if len(f.shape) == 1: f = f[newaxis,:]
+    bg = (f == 0)
+    if f.shape[1] > f.shape[0]:             # loop along the shorter side
+        if not index: return _edt(~bg.T).T
+        d2,r,c = _edt(~bg.T, 1)
+        return d2.T, c.T, r.T
+    h,w = bg.shape
+    inf = h + w
+    i = arange(h)[:,newaxis]
+    up = maximum.accumulate(where(bg, i, -inf), axis=0)
+    down = minimum.accumulate(where(bg, i, h+inf)[::-1], axis=0)[::-1]
+    g2 = minimum(minimum(i - up, down - i), inf)**2
+    gr = where(i - up <= down - i, up, down).clip(0, h-1)
+    rows = arange(h)
+    s = zeros((h,w), int)                   # columns of the envelope parabolas
+    t = zeros((h,w), int)                   # where each one starts
+    q = zeros(h, int)
+    for u in xrange(1,w):
+        while True:
+            sq = s[rows,q]
+            tq = t[rows,q]
+            pop = (q >= 0) & ((tq-sq)**2 + g2[rows,sq] > (tq-u)**2 + g2[:,u])
+            if not pop.any(): break
+            q[pop] -= 1
+        first = q < 0
+        q[first] = 0
+        s[first,0] = u
+        sq = s[rows,q]
+        den = 2*(u - sq)
+        den[first] = 1
+        wu = 1 + (u*u - sq*sq + g2[:,u] - g2[rows,sq]) // den
+        add = ~first & (wu < w)
+        q[add] += 1
+        s[rows[add],q[add]] = u
+        t[rows[add],q[add]] = wu[add]
+    d2 = empty((h,w), int)
+    c = empty((h,w), int)
+    for u in xrange(w-1,-1,-1):
+        sq = s[rows,q]
+        d2[:,u] = (u - sq)**2 + g2[rows,sq]
+        c[:,u] = sq
+        q[u == t[rows,q]] -= 1
+    if not bg.any(): d2[:] = -1
+    if not index: return d2
+    return d2, gr[rows[:,newaxis], c], c
+
+
 def edgeoff(f, Bc=None):
     """
         - Purpose
@@ -679,7 +853,10 @@ def label(f, Bc=None):
             of a binary image f , according to the connectivity defined by
             the structuring element Bc . The background pixels (with value
             0) are not labeled. The maximum label value in the output image
-            gives the number of its connected components.
+            gives the number of its connected components. Components are
+            numbered in the raster order of their first pixel. For a flat,
+            symmetric Bc the labeling is a two-pass union-find over the
+            neighbour pairs of the image.
         - Examples
             #
             #   example 1
@@ -702,13 +879,16 @@ def label(f, Bc=None):
     from numpy import allclose, ravel, nonzero, array
     if Bc is None: Bc = secross()
     assert isbinary(f),'Can only label binary image'
+    offsets = _symoffsets(Bc)
+    if offsets is not None:
+        return _labelcc(f, f, offsets)
     zero = subm(f,f)               # zero image
     faux=f
     r = array(zero)
     label = 1
     y = gray( f,'uint16',0)        # zero image (output)
     while not allclose(faux,0):
-        x=nonzero(ravel(faux))[0]      # get first unlabeled pixel
+        x=nonzero(ravel(faux))[0][0]   # get first unlabeled pixel
         fmark = array(zero)
         fmark.flat[x] = 1              # get the first unlabeled pixel
         r = infrec( fmark, faux, Bc) # detects all pixels connected to it
@@ -719,6 +899,90 @@ def label(f, Bc=None):
     return y
 
 
+def _symoffsets(Bc):
+    """
+    x = _symoffsets(Bc)
+
+    Neighbour offsets (dr,dc) of the flat, symmetric connectivity Bc,
+    without the origin. Returns None for other structuring elements.
+    """
+    if not isbinary(Bc): return None
+    x,v = mat2set(Bc)
+    x = set([(dr,dc) for dr,dc in x if dr or dc])
+    if x != set([(-dr,-dc) for dr,dc in x]): return None
+    return sorted(x)
+
+
+def _labelcc(f, m, offsets, link=None):
+    """
+    y = _labelcc(f, m, offsets, link=None)
+
+    Two-pass union-find labeling of the pixels of the binary image m,
+    where neighbours p and p + offset are merged when link(f[p], f[q]) is
+    true (always, if link is None). Labels are numbered in the raster
+    order of the first pixel of each component. The output is uint16, or
+    int32 when there are more than 65535 labels.
+    """
+    import numpy
+    from numpy import newaxis, zeros, empty, arange, flatnonzero, concatenate, int32, uint16
+    if len(m.shape) == 1:
+        f,m = f[newaxis,:],m[newaxis,:]
+    grid = _Grid(m.shape, offsets)
+    mp = grid.pad(m, 0, bool)
+    fp = grid.pad(f, 0)
+    pix = flatnonzero(mp)                   # raster order
+    node = empty(grid.size, int)
+    node[pix] = arange(len(pix))
+    us,vs = [],[]
+    for o in grid.o:                        # first pass: the equivalences
+        if o < 0: continue
+        q = pix + o
+        ok = mp[q]
+        if link is not None:
+            ok &= link(fp[pix], fp[q])
+        us.append(node[pix[ok]])
+        vs.append(node[q[ok]])
+    root = _unionfind(len(pix), concatenate(us + [zeros(0,int)]),
+                                concatenate(vs + [zeros(0,int)]))
+    isroot = (root == arange(len(pix)))     # roots are the first pixels
+    lbl = isroot.cumsum()
+    n = lbl[-1] if len(lbl) else 0
+    if n > 65535: y = zeros(grid.size, int32)
+    else:         y = zeros(grid.size, uint16)
+    y[pix] = lbl[root]                      # second pass: resolve
+    return grid.crop(y)
+
+
+def _unionfind(n, u, v):
+    """
+    root = _unionfind(n, u, v)
+
+    Array-backed union-find over n nodes with the edges (u[i], v[i]). Each
+    round compresses every path, then hooks each root onto the smallest
+    root it is linked to. root[i] is the smallest node of the component
+    of node i.
+    """
+    from numpy import arange, minimum, maximum, argsort, concatenate
+    parent = arange(n)
+    while True:
+        while True:
+            pp = parent[parent]
+            if (pp == parent).all(): break
+            parent = pp
+        ru,rv = parent[u],parent[v]
+        diff = ru != rv
+        if not diff.any(): break
+        u,v = u[diff],v[diff]
+        hi = maximum(ru[diff],rv[diff])
+        lo = minimum(ru[diff],rv[diff])
+        k = argsort(hi*n + lo)
+        hi,lo = hi[k],lo[k]
+        first = concatenate(([True], hi[1:] != hi[:-1]))
+        hi,lo = hi[first],lo[first]
+        parent[hi] = minimum(parent[hi],lo)
+    return parent
+
+
 def neg(f):
     """
         - Purpose
@@ -759,6 +1023,8 @@ def neg(f):
             show(d)
     """
 
+    if isinstance(f, PackedBinary):
+        return _packed(~f.words & _packmask(f), f.shape)
     y = limits(f)[0] + limits(f)[1] - f
     y = y.astype(f.dtype)
     return y
@@ -862,17 +1128,19 @@ def toggle(f, f1, f2, OPTION="GRAY"):
     return y
 
 
-def addm(f1, f2):
+def addm(f1, f2, out=None):
     """
         - Purpose
             Addition of two images, with saturation.
         - Synopsis
-            y = addm(f1, f2)
+            y = addm(f1, f2, out=None)
         - Input
-            f1: Unsigned gray-scale (uint8 or uint16), signed (int32) or
-                binary image.
-            f2: Unsigned gray-scale (uint8 or uint16), signed (int32) or
-                binary image. Or constant.
+            f1:  Unsigned gray-scale (uint8 or uint16), signed (int32) or
+                 binary image.
+            f2:  Unsigned gray-scale (uint8 or uint16), signed (int32) or
+                 binary image. Or constant.
+            out: Image. Default: None. Output buffer, with the datatype of
+                 f1 and the shape of the result.
         - Output
             y: Unsigned gray-scale (uint8 or uint16), signed (int32) or
                binary image.
@@ -880,7 +1148,10 @@ def addm(f1, f2):
             addm creates the image y by pixelwise addition of images f1
             and f2 . When the addition of the values of two pixels saturates
             the image data type considered, the greatest value of this type
-            is taken as the result of the addition.
+            is taken as the result of the addition. When f2 is an image of
+            the same datatype as f1 or an integer constant, the addition is
+            computed in the datatype of f1 (int32 images are widened to 64
+            bits).
         - Examples
             #
             #   example 1
@@ -903,11 +1174,56 @@ def addm(f1, f2):
 
     if type(f2) is array:
         assert f1.dtype == f2.dtype, 'Cannot have different datatypes:'
-    y = maximum(minimum(f1.astype('d')+f2, limits(f1)[1]),limits(f1)[0])
-    y = y.astype(f1.dtype)
+    y = _satarith(f1, f2, 0, out)
+    if y is None:
+        y = maximum(minimum(f1.astype('d')+f2, limits(f1)[1]),limits(f1)[0])
+        y = y.astype(f1.dtype)
+        if out is not None:
+            out[...] = y
+            y = out
     return y
 
 
+def _satarith(f1, f2, sub, out):
+    """
+    y = _satarith(f1, f2, sub, out)
+
+    Saturated f1 + f2 (or f1 - f2 if sub) computed in the datatype of f1.
+    Binary images use logical operators and uint8/uint16 images use
+    f1 + min(f2, k2 - f1) and f1 - min(f1, f2), which cannot overflow;
+    int32 images are widened to int64. Returns None when f2 is neither an
+    image of the datatype of f1 nor an integer constant.
+    """
+    import numpy
+    from numpy import asarray, broadcast, empty, minimum, clip, int64
+
+    k1,k2 = limits(f1)
+    k1,k2 = int(k1),int(k2)
+    a2 = asarray(f2)
+    if a2.shape == ():
+        if a2.dtype.kind not in 'biuf' or a2 != int(a2): return None
+        c = int(a2)
+        if c < 0: c,sub = -c,not sub
+        a2 = min(c,k2-k1)
+    elif a2.dtype != f1.dtype:
+        return None
+    if out is None:
+        out = empty(broadcast(f1,a2).shape, f1.dtype)
+    if f1.dtype == bool:
+        if sub: numpy.logical_and(f1, numpy.logical_not(a2), out)
+        else:   numpy.logical_or(f1, a2, out)
+    elif f1.dtype.kind == 'u':
+        a2 = asarray(a2).astype(f1.dtype)
+        if sub: numpy.subtract(f1, minimum(f1,a2), out)
+        else:   numpy.add(f1, minimum(a2,k2-f1), out)
+    else:
+        y = f1.astype(int64)
+        if sub: y -= a2
+        else:   y += a2
+        out[...] = clip(y,k1,k2)
+    return out
+
+
 def areaclose(f, a, Bc=None):
     """
         - Purpose
@@ -915,7 +1231,8 @@ def areaclose(f, a, Bc=None):
         - Synopsis
             y = areaclose(f, a, Bc=None)
         - Input
-            f:  Gray-scale (uint8 or uint16) or binary image.
+            f:  Gray-scale (uint8 or uint16) or binary image, or the min-tree
+                (ComponentTree) of a gray-scale image.
             a:  Double non negative integer.
             Bc: Structuring Element Default: None (3x3 elementary cross). (
                 connectivity).
@@ -927,7 +1244,9 @@ def areaclose(f, a, Bc=None):
             connectivity is given by the structuring element Bc . This
             operator is generalized to gray-scale images by applying the
             binary operator successively on slices of f taken from higher
-            threshold levels to lower threshold levels.
+            threshold levels to lower threshold levels. For uint8 and uint16
+            images it is computed as one area filtering of the min-tree of
+            f .
         - Examples
             #
             #   example 1
@@ -946,6 +1265,12 @@ def areaclose(f, a, Bc=None):
     """
 
     if Bc is None: Bc = secross()
+    if isinstance(f, ComponentTree):
+        assert f.dual,'areaclose needs a min-tree'
+        return f.filter(f.area >= a)
+    if _symoffsets(Bc) is not None and datatype(f) in ('uint8', 'uint16'):
+        t = ComponentTree(f,Bc,True)
+        return t.filter(t.area >= a)
     y = neg(areaopen(neg(f),a,Bc))
     return y
 
@@ -957,7 +1282,8 @@ def areaopen(f, a, Bc=None):
         - Synopsis
             y = areaopen(f, a, Bc=None)
         - Input
-            f:  Gray-scale (uint8 or uint16) or binary image.
+            f:  Gray-scale (uint8 or uint16) or binary image, or the max-tree
+                (ComponentTree) of a gray-scale image.
             a:  Double non negative integer.
             Bc: Structuring Element Default: None (3x3 elementary cross). (
                 connectivity).
@@ -969,7 +1295,9 @@ def areaopen(f, a, Bc=None):
             by the structuring element Bc . This operator is generalized to
             gray-scale images by applying the binary operator successively
             on slices of f taken from higher threshold levels to lower
-            threshold levels.
+            threshold levels. For uint8 and uint16 images the slices are
+            the nodes of the max-tree of f , which is built once and
+            filtered by area in a single pass.
         - Examples
             #
             #   example 1
@@ -1006,10 +1334,16 @@ def areaopen(f, a, Bc=None):
     """
 
     if Bc is None: Bc = secross()
-    if isbinary(f):
+    if isinstance(f, ComponentTree):
+      assert not f.dual,'areaopen needs a max-tree'
+      y = f.filter(f.area >= a)
+    elif isbinary(f):
       fr = label(f,Bc)      # binary area open, use area measurement
       g = blob(fr,'area')
       y = threshad(g,a)
+    elif _symoffsets(Bc) is not None and datatype(f) in ('uint8', 'uint16'):
+      t = ComponentTree(f,Bc)
+      y = t.filter(t.area >= a)
     else:
       y = intersec(f,0)
       zero = binary(y)
@@ -1024,6 +1358,131 @@ def areaopen(f, a, Bc=None):
     return y
 
 
+def _maxtree(f, offsets, dual=0):
+    """
+    parent, level, pnode, area, vsum, top, box = _maxtree(f, offsets, dual=0)
+
+    Max-tree of f (min-tree if dual) for the connectivity given by the
+    neighbour offsets. Nodes are the connected components of the upper
+    (lower) level sets at the levels that occur in f, numbered from the
+    leaves to the roots, so parent[n] > n except at a root, where
+    parent[n] == n. pnode gives the node of each pixel at its own level.
+    Each node also gets the sum vsum and the maximum (minimum if dual) top
+    of f over its component, and its bounding box rows (rmin, cmin, rmax,
+    cmax). The tree is built level by level with a union-find over the
+    pixels, merging by size.
+    """
+    from numpy import newaxis, zeros, ones, empty, arange, flatnonzero, argsort, \
+         concatenate, unique, searchsorted, minimum, maximum, add
+    if len(f.shape) == 1: f = f[newaxis,:]
+    h,w = f.shape
+    grid = _Grid(f.shape, offsets)
+    mp = grid.inside()
+    pix = grid.pixels()
+    N = len(pix)
+    idx = empty(grid.size, int)
+    idx[pix] = arange(N)
+    key = f.ravel().astype(int)
+    if dual: key = -key
+    us,vs = [],[]
+    for o in grid.o:
+        if o < 0: continue
+        q = pix + o
+        ok = mp[q]
+        us.append(idx[pix[ok]])
+        vs.append(idx[q[ok]])
+    u = concatenate(us + [zeros(0,int)])
+    v = concatenate(vs + [zeros(0,int)])
+    wk = minimum(key[u], key[v])
+    k = argsort(-wk)
+    u,v,wk = u[k],v[k],wk[k]
+    porder = argsort(-key)
+    levels = unique(key)[::-1]
+    pb = searchsorted(-key[porder], -levels, 'right')
+    eb = searchsorted(-wk, -levels, 'right')
+    link = arange(N)                        # union-find over the pixels
+    size = ones(N, int)                     # attributes of the sets of link
+    ksum = key.copy()
+    ktop = key.copy()
+    bcol = [arange(N) // w, arange(N) % w]
+    bcol = [bcol[0], bcol[1], bcol[0].copy(), bcol[1].copy()]
+    loc = empty(N, int)
+    rootnode = empty(N, int)
+    pnode = empty(N, int)
+    parent = arange(N)
+    level = empty(N, int)
+    area = empty(N, int)
+    vsum = empty(N, int)
+    top = empty(N, int)
+    box = empty((4,N), int)
+    nn = 0; p0 = 0; e0 = 0
+    for l,p1,e1 in zip(levels, pb, eb):
+        P = porder[p0:p1]
+        ru = _find(link, u[e0:e1])
+        rv = _find(link, v[e0:e1])
+        cand = concatenate((P, ru, rv))
+        loc[cand] = arange(len(cand))       # one survivor per pixel
+        items = cand[loc[cand] == arange(len(cand))]
+        loc[items] = arange(len(items))
+        g = _unionfind(len(items), loc[ru], loc[rv])
+        isg = (g == arange(len(items)))
+        G = (isg.cumsum() - 1)[g]
+        ng = isg.sum()
+        old = key[items] > l
+        parent[rootnode[items[old]]] = nn + G[old]
+        o = argsort(G*(N+1) + size[items])
+        io = items[o]
+        first = concatenate(([True], G[o][1:] != G[o][:-1]))
+        start = flatnonzero(first)
+        rep = io[concatenate((first[1:], [True]))]
+        link[items] = rep[G]
+        size[rep] = area[nn:nn+ng] = add.reduceat(size[io], start)
+        ksum[rep] = vsum[nn:nn+ng] = add.reduceat(ksum[io], start)
+        ktop[rep] = top[nn:nn+ng] = maximum.reduceat(ktop[io], start)
+        for i in xrange(4):
+            red = i < 2 and minimum or maximum
+            bcol[i][rep] = box[i,nn:nn+ng] = red.reduceat(bcol[i][io], start)
+        rootnode[rep] = nn + arange(ng)
+        level[nn:nn+ng] = l
+        pnode[P] = nn + G[loc[P]]
+        nn += ng; p0 = p1; e0 = e1
+    level,vsum,top = level[:nn],vsum[:nn],top[:nn]
+    if dual: level,vsum,top = -level,-vsum,-top
+    return parent[:nn], level, pnode.reshape(h,w), area[:nn], vsum, top, box[:,:nn]
+
+
+def _find(link, x):
+    """
+    r = _find(link, x)
+
+    Roots of the nodes x in the union-find table link, halving the paths
+    that are walked.
+    """
+    r = x
+    while True:
+        pr = link[r]
+        if (pr == r).all(): return r
+        ppr = link[pr]
+        link[r] = ppr
+        r = ppr
+
+
+def _pathmax(parent, v):
+    """
+    y = _pathmax(parent, v)
+
+    y[n] is the maximum of v over node n and all its ancestors in the
+    tree given by parent, computed by pointer jumping.
+    """
+    from numpy import maximum
+    anc = parent
+    while True:
+        v = maximum(v, v[anc])
+        anc2 = anc[anc]
+        if (anc2 == anc).all(): return v
+        anc = anc2
+
+
 def flood(fin, T, option, Bc=None):
     """
         - Purpose
@@ -1031,7 +1490,8 @@ def flood(fin, T, option, Bc=None):
         - Synopsis
             y = flood(fin, T, option, Bc=None)
         - Input
-            fin:    Gray-scale (uint8 or uint16) image.
+            fin:    Gray-scale (uint8 or uint16) image, or its min-tree
+                    (ComponentTree).
             T:      Criterion value. If T==-1, then the dynamics is
                     determined, not the flooding at this criterion. This was
                     selected just to use the same algoritm to compute two
@@ -1040,7 +1500,8 @@ def flood(fin, T, option, Bc=None):
             Bc:     Structuring Element Default: None (3x3 elementary
                     cross). Connectivity.
         - Output
-            y: Gray-scale (uint8 or uint16) image.
+            y: Gray-scale (uint8 or uint16) image. The dynamics is an int32
+               image.
         - Description
             This is a flooding algorithm. It is the basis to implement many
             topological functions. It is a connected filter that floods an
@@ -1056,12 +1517,68 @@ def flood(fin, T, option, Bc=None):
             particular level. This test happens in the raising of the water
             and in the merging of basins.
 
+            The immersion is the min-tree of fin , built once level by
+            level. At water level l a lake L has area |L| , volume
+            sum(l-fin(p)+1) and depth l-min(fin) over p in L . A lake stops
+            rising at the first level where its criterion reaches T (at
+            the maximum of the datatype if it never does). The dynamics
+            image gives, at each regional minimum, the criterion of its lake
+            at the level where it merges with a more significant one: a
+            deeper one for 'H', a larger one for 'AREA' and 'VOLUME' (the
+            volume counts sum(l-fin(p)) there). The most significant
+            minimum merges at the maximum of the datatype. Other pixels are
+            0.
+        - Examples
+            #
+            f=readgray('astablet.tif')
+            g=gradm(f)
+            show(flood(g,1000,'volume'))
+            show(flood(g,-1,'h'))
     """
-
+    from numpy import where, ceil, arange, lexsort, flatnonzero, concatenate, zeros, int32
+    from string import upper
     if Bc is None: Bc = secross()
-    print 'Not implemented yet'
-    return None
-    return y
+    if isinstance(fin, ComponentTree):
+        assert fin.dual,'flood needs a min-tree'
+        t = fin
+    else:
+        t = ComponentTree(fin,Bc,True)
+    option = upper(option)
+    assert option in ('AREA', 'VOLUME', 'H'),"option should be 'AREA', 'VOLUME' or 'H'"
+    k2 = limits(t)[1]
+    L, area = t.level, t.area
+    isroot = (t.parent == arange(len(L)))
+    Lp = where(isroot, k2 + 1, L[t.parent])   # lake of a node lives in [L, Lp)
+    S = (L + 1)*area - t.volume              # sum of fin over the lake
+    bottom = L - t.height
+    if T == -1:
+        Lm = Lp.clip(0,k2)                   # merge level
+        if   option == 'H':    s = Lm - bottom
+        elif option == 'AREA': s = area
+        else:                  s = Lm*area - S
+        child = flatnonzero(~isroot)       # ties go to the deeper minimum
+        o = child[lexsort((-bottom[child], s[child], t.parent[child]))]
+        last = concatenate((t.parent[o][1:] != t.parent[o][:-1], [True]))
+        win = zeros(len(L), bool)
+        win[o[last]] = True                  # the most significant child
+        anc = where(win, t.parent, arange(len(L)))
+        while True:                          # first ancestor where it lost
+            anc2 = anc[anc]
+            if (anc2 == anc).all(): break
+            anc = anc2
+        inner = zeros(len(L), bool)
+        inner[t.parent[child]] = True
+        dyn = where(inner, 0, s[anc])
+        return dyn.astype(int32)[t.pnode]
+    if option == 'AREA':
+        c = where(area >= T, L, k2 + 1)
+    elif option == 'VOLUME':
+        c = ceil((T + S)/area).astype(int) - 1
+    else:
+        c = bottom + T
+    c = c.clip(L)
+    c = where(c < Lp, c, k2)
+    return t.reconstruct(c)
 
 
 def asf(f, SEQ="OC", b=None, n=1):
@@ -1238,7 +1755,8 @@ def blob(fr, measurement, option="image"):
                 
             The region with label zero is not measured as it is normally
             the background. The measurement of region with label 1 appears
-            at the first row of the output.
+            at the first row of the output. All regions are measured
+            together, in one pass over the labeled pixels.
         - Examples
             #
             #   example 1
@@ -1283,53 +1801,65 @@ def blob(fr, measurement, option="image"):
             show(f,box)
     """
     import numpy
-    from numpy import newaxis, ravel, zeros, sum, nonzero, array
+    from numpy import newaxis, ravel, zeros, bincount, flatnonzero, minimum, maximum, repeat, concatenate, column_stack
     from string import upper
 
     measurement = upper(measurement)
     option      = upper(option)
     if len(fr.shape) == 1: fr = fr[newaxis,:]
-    n = fr.max()
-    if option == 'DATA':
-        y = []
-    elif measurement == 'CENTROID':
-        y = zeros(fr.shape,numpy.bool)
-    else:
-        y = zeros(fr.shape,numpy.int32)
+    n = int(fr.max())
+    h,w = fr.shape
+    ind = flatnonzero(fr)
+    lbl = ravel(fr)[ind].astype(int)
+    area = bincount(lbl, minlength=n+1)
+    present = flatnonzero(area[1:]) + 1
     if measurement == 'AREA':
-        for i in xrange(1,n+1):
-            aux  = (fr==i)
-            area = aux.sum()
-            if option == 'DATA': y.append(area)
-            else               : y += area*aux
+        if option == 'DATA': y = area[1:]
+        else               : y = area.astype(numpy.int32)[fr.astype(int)]
     elif measurement == 'CENTROID':
-        for i in xrange(1,n+1):
-            aux  = (fr==i)
-            ind,  = nonzero(ravel(aux))
-            indx = ind // fr.shape[1]
-            indy = ind % fr.shape[1]
-            centroid = [sum(indx)//len(ind), sum(indy)//len(ind)]
-            if option == 'DATA': y.append([centroid[1],centroid[0]])
-            else               : y[centroid] = 1
+        nz = maximum(area, 1)
+        row = bincount(lbl, ind // w, minlength=n+1).astype(int) // nz
+        col = bincount(lbl, ind %  w, minlength=n+1).astype(int) // nz
+        if option == 'DATA':
+            y = column_stack((col[1:], row[1:]))
+        else:
+            y = zeros(fr.shape,numpy.bool)
+            y[row[present],col[present]] = 1
     elif measurement == 'BOUNDINGBOX':
-        for i in xrange(1,n+1):
-            aux = fr==i
-            aux1, aux2 = aux.any(0), aux.any(1)
-            col , row  = nonzero(aux1)  , nonzero(aux2)
-            if option == 'DATA': y.append([col[0],row[0],col[-1],row[-1]])
-            else:
-                y[row[0]:row[-1],col[0] ] = 1
-                y[row[0]:row[-1],col[-1]] = 1
-                y[row[0], col[0]:col[-1]] = 1
-                y[row[-1],col[0]:col[-1]] = 1
+        rmin = zeros(n+1, int) + h; rmax = zeros(n+1, int)
+        cmin = zeros(n+1, int) + w; cmax = zeros(n+1, int)
+        minimum.at(rmin, lbl, ind // w); maximum.at(rmax, lbl, ind // w)
+        minimum.at(cmin, lbl, ind %  w); maximum.at(cmax, lbl, ind %  w)
+        if option == 'DATA':
+            y = column_stack((cmin[1:], rmin[1:], cmax[1:], rmax[1:]))
+            y[area[1:] == 0] = 0
+        else:
+            r0,r1,c0,c1 = rmin[present],rmax[present],cmin[present],cmax[present]
+            rr = _spans(r0, r1-r0+1)
+            cc = _spans(c0, c1-c0+1)
+            y = zeros(fr.shape,numpy.int32)
+            y[concatenate((rr, rr, repeat(r0, c1-c0+1), repeat(r1, c1-c0+1))),
+              concatenate((repeat(c0, r1-r0+1), repeat(c1, r1-r0+1), cc, cc))] = 1
     else:
         print "Measurement option should be 'AREA','CENTROID', or 'BOUNDINGBOX'."
+        if option == 'DATA': y = zeros(0, int)
+        else               : y = zeros(fr.shape,numpy.int32)
     if option == 'DATA':
-        y = array(y)
         if len(y.shape) == 1: y = y[:,newaxis]
     return y
 
 
+def _spans(start, length):
+    """
+    y = _spans(start, length)
+
+    Concatenation of the integer ranges start[i], ..., start[i]+length[i]-1.
+    """
+    from numpy import arange, repeat, cumsum
+    off = cumsum(length) - length
+    return repeat(start - off, length) + arange(length.sum())
+
+
 def cbisector(f, B, n):
     """
         - Purpose
@@ -1651,7 +2181,8 @@ def cthick(f, g, Iab=None, n=-1, theta=45, DIRECTION="CLOCKWISE"):
             of the binary image f conditioned to the binary image g . The
             number of iterations of the conditional thickening is n and in
             each iteration the thickening is characterized by rotations of
-            theta of the interval Iab .
+            theta of the interval Iab . As in thin , flat 3x3 rotations are
+            only tested again next to the pixels that changed.
         - Examples
             #
             #   example 1
@@ -1677,11 +2208,16 @@ def cthick(f, g, Iab=None, n=-1, theta=45, DIRECTION="CLOCKWISE"):
     DIRECTION = upper(DIRECTION)            
     assert isbinary(f),'f must be binary image'
     if n == -1: n = product(f.shape)
+    rots = [interot(Iab, t, DIRECTION) for t in xrange(0,360,theta)]
+    bits = [_hmtbits(A, Bc) for A,Bc in rots]
+    packed = isinstance(f, PackedBinary) or isinstance(g, PackedBinary)
+    if all(bits) and not packed:
+        return _thinning(f, g, bits, n, 'cthick')
     y = f
     old = y
     for i in xrange(n):
-        for t in xrange(0,360,theta):
-            sup = supgen( y, interot(Iab, t, DIRECTION))
+        for Irot in rots:
+            sup = supgen( y, Irot)
             y = intersec(union( y, sup),g)
         if isequal(old,y): break
         old = y
@@ -1712,7 +2248,8 @@ def cthin(f, g, Iab=None, n=-1, theta=45, DIRECTION="CLOCKWISE"):
             the binary image f conditioned to the binary image g . The
             number of iterations of the conditional thinning is n and in
             each iteration the thinning is characterized by rotations of
-            theta of the interval Iab .
+            theta of the interval Iab . As in thin , flat 3x3 rotations are
+            only tested again next to the pixels that changed.
 
     """
     from numpy import product
@@ -1721,23 +2258,28 @@ def cthin(f, g, Iab=None, n=-1, theta=45, DIRECTION="CLOCKWISE"):
     DIRECTION = upper(DIRECTION)            
     assert isbinary(f),'f must be binary image'
     if n == -1: n = product(f.shape)
+    rots = [interot(Iab, t, DIRECTION) for t in xrange(0,360,theta)]
+    bits = [_hmtbits(A, Bc) for A,Bc in rots]
+    packed = isinstance(f, PackedBinary) or isinstance(g, PackedBinary)
+    if all(bits) and not packed:
+        return _thinning(f, g, bits, n, 'cthin')
     y = f
     old = y
     for i in xrange(n):
-        for t in xrange(0,360,theta):
-            sup = supgen( y, interot(Iab, t, DIRECTION))
+        for Irot in rots:
+            sup = supgen( y, Irot)
             y = union(subm( y, sup),g)
         if isequal(old,y): break
         old = y
     return y
 
 
-def cwatershed(f, g, Bc=None, LINEREG="LINES"):
+def cwatershed(f, g, Bc=None, LINEREG="LINES", TILE=None, NPROC=None):
     """
         - Purpose
             Detection of watershed from markers.
         - Synopsis
-            Y = cwatershed(f, g, Bc=None, LINEREG="LINES")
+            Y = cwatershed(f, g, Bc=None, LINEREG="LINES", TILE=None, NPROC=None)
         - Input
             f:       Gray-scale (uint8 or uint16) image.
             g:       Gray-scale (uint8 or uint16) or binary image. marker
@@ -1745,6 +2287,10 @@ def cwatershed(f, g, Bc=None, LINEREG="LINES"):
             Bc:      Structuring Element Default: None (3x3 elementary
                      cross). (watershed connectivity)
             LINEREG: String Default: "LINES". 'LINES' or ' REGIONS'.
+            TILE:    Integer Default: None. Side of the square tiles
+                     flooded separately. None floods the whole image.
+            NPROC:   Integer Default: None (one per CPU). Number of worker
+                     processes for the tiles.
         - Output
             Y: Gray-scale (uint8 or uint16) or binary image.
         - Description
@@ -1755,11 +2301,28 @@ def cwatershed(f, g, Bc=None, LINEREG="LINES"):
             domain or just a binary image that presents the watershed lines.
             To know more about watershed and watershed from markers, see
             BeucMeye:93 . The implementation of this function is based on
-            LotuFalc:00 . WARNING: There is a coon mistake related to the
-            marker image g . If this image contains only zeros and ones, but
-            it is not a binary image, the result will be an image with all
-            ones. If the marker image is binary, you have to set this
-            explicitly using the logical function.
+            LotuFalc:00 : the markers flood f through a hierarchical queue
+            with one FIFO per gray level (a heap of the levels in use for
+            int32 images), each pixel taking the label of the first
+            neighbour that reaches it, or of the smallest label among the
+            neighbours that reach it at the same time. A pixel is a
+            watershed line pixel when, at its turn, it touches a pixel
+            already flooded by another label that is not itself a line
+            pixel. With TILE , the tiles are flooded by a pool of NPROC
+            worker processes, each with the pixels just around it held to
+            what their own tiles last found for them, and the tiles next
+            to a tile border that changed are flooded again until none
+            changes. The result is always the same as without TILE . The
+            memory used besides f , g and y follows the size of the tiles
+            rather than that of the image. A tile is usually flooded two
+            or three times, more when basins cross many tiles, so TILE
+            pays off with several processes, tiles of a thousand pixels or
+            more a side, and basins much smaller than the tiles. WARNING:
+            There is a coon mistake related to the marker image g . If
+            this image contains only zeros and ones, but it is not a
+            binary image, the result will be an image with all ones. If
+            the marker image is binary, you have to set this explicitly
+            using the logical function.
         - Examples
             #
             #   example 1
@@ -1785,64 +2348,285 @@ def cwatershed(f, g, Bc=None, LINEREG="LINES"):
             show(mark)
             show(w)
     """
-    from numpy import ones, zeros, nonzero, array, put, take, argmin, transpose, compress, concatenate
+    from string import upper
+    from numpy import asarray, newaxis
     if Bc is None: Bc = secross()
-    return g
-    print 'starting'
-    withline = (LINEREG == 'LINES')
+    LINEREG = upper(LINEREG).strip()
+    assert LINEREG in ['LINES','REGIONS'],'LINEREG should be LINES or REGIONS'
     if isbinary(g):
         g = label(g,Bc)
-    print 'before 1. pad4n'
-    status = pad4n(to_uint8(zeros(f.shape)),Bc, 3)
-    f = pad4n( f,Bc,0)                 #pad input image
-    print 'before 2. pad4n'
-    y = pad4n( g,Bc,0)                  # pad marker image with 0
-    if withline:
-        y1 = intersec(binary(y), 0)
-    costM = limits(f)[1] * ones(f.shape)  # cuulative cost function image
-    mi = nonzero(gradm(y,sebox(0),Bc).ravel())  # 1D index of internal contour of marker
-    print 'before put costM'
-    put(costM.ravel(),mi, 0)
-    HQueue=transpose([mi, take(costM.ravel(), mi)])       # init hierarquical queue: index,value
-    print 'before se2list0'
-    Bi=se2list0(f,Bc)                # get 1D displacement neighborhood pixels
-    x,v = mat2set(Bc)
-    while HQueue:
-        print 'Hq=',HQueue
-        i = argmin(HQueue[:,1])           # i is the index of minimum value
-        print 'imin=',i
-        pi = HQueue[i,0]
-        print 'pi=',pi
-        ii = ones(HQueue.shape[0])
-        ii[i] = 0
-        print 'ii=',ii
-        HQueue = transpose(array([compress(ii,HQueue[:,0]),
-                                  compress(ii,HQueue[:,1])])) # remove this pixel from queue
-        print 'H=',HQueue
-        put(status.ravel(), pi, 1)          # make it a permanent label
-        for qi in pi+Bi :                # for each neighbor of pi
-            if (status.flat[qi] != 3):          # not image border
-                if (status.flat[qi] != 1):        # if not permanent
-                    cost_M = max(costM.flat[pi], f.flat[qi])
-                    if cost_M < costM.flat[qi]:
-                        print 'qi=',qi
-                        costM.flat[qi] = cost_M
-                        y.flat[qi] = y.flat[pi]                  # propagate the label
-                        aux = zeros(array(HQueue.shape) + [1,0])
-                        aux[:-1,:] = HQueue
-                        aux[-1,:]=[qi, cost_M]
-                        HQueue = aux # insert pixel in the queue
-                        print 'insert H=',HQueue
-                elif (withline        and
-                     (y.flat[qi] != y.flat[pi]) and
-                     (y1.flat[pi] == 0)    and
-                     (y1.flat[qi] == 0)     ):
-                    y1.flat[pi] = 1
-    if withline:
-        Y = y1
+    f,g = asarray(f),asarray(g)
+    shape = f.shape
+    if len(f.shape) == 1: f = f[newaxis,:]
+    if len(g.shape) == 1: g = g[newaxis,:]
+    x,v = mat2set(binary(Bc))
+    offsets = [(dr,dc) for dr,dc in x if dr or dc]
+    if TILE is None:
+        y,line = _cwshed(f, g, offsets, LINEREG == 'LINES')
     else:
-        Y = y
-    return Y
+        y,line = _tiledws(f, g, offsets, LINEREG == 'LINES', TILE, NPROC)
+    if LINEREG == 'LINES':
+        return binary(line).reshape(shape)
+    return y.astype(g.dtype).reshape(shape)
+
+
+def _tiledws(f, g, offsets, lines, tile, nproc=None):
+    """
+    y, line = _tiledws(f, g, offsets, lines, tile, nproc=None)
+
+    _cwshed over square tiles of side tile , flooded by a pool of nproc
+    worker processes a few tiles at a time. Each tile is flooded with the
+    pixels around it within reach of offsets held fixed, with the label,
+    line, level and wave rank their own tiles last gave them, so only y ,
+    line and the levels and ranks along the tile borders are kept. The
+    tiles next to a border that changed are flooded again, until none
+    changes. The flooding rules then hold at every pixel and, as they
+    have a single solution, y and line are those of _cwshed on the whole
+    image.
+    """
+    from numpy import zeros, ones, int32
+    h,w = f.shape
+    tile = max(int(tile), 1)
+    lo = int(f.min())
+    mh = max([abs(dr) for dr,dc in offsets] + [0])
+    mw = max([abs(dc) for dr,dc in offsets] + [0])
+    y = zeros(g.shape, g.dtype)
+    line = zeros(g.shape, bool)
+    band = {}                               # (r, c, level, rank) strips of each tile
+    def near(r, c):                         # the tiles within reach of tile r, c
+        return [(rr,cc) for rr in xrange(max(r-mh,0)//tile*tile, min(r+tile+mh,h), tile)
+                        for cc in xrange(max(c-mw,0)//tile*tile, min(c+tile+mw,w), tile)
+                        if (rr,cc) != (r,c)]
+    def window(r, c):
+        r0,r1,c0,c1 = max(r-mh,0), min(r+tile+mh,h), max(c-mw,0), min(c+tile+mw,w)
+        mask = ones((r1-r0,c1-c0), bool)
+        mask[r-r0:r+tile-r0, c-c0:c+tile-c0] = 0
+        fc = zeros(mask.shape, int) - 1
+        fd = zeros(mask.shape, int32)
+        for core in near(r, c):
+            for sr,sc,sk,sd in band.get(core, []):
+                a0,a1 = max(sr,r0), min(sr+sk.shape[0],r1)
+                b0,b1 = max(sc,c0), min(sc+sk.shape[1],c1)
+                if a0 >= a1 or b0 >= b1: continue
+                fc[a0-r0:a1-r0, b0-c0:b1-c0] = sk[a0-sr:a1-sr, b0-sc:b1-sc]
+                fd[a0-r0:a1-r0, b0-c0:b1-c0] = sd[a0-sr:a1-sr, b0-sc:b1-sc]
+        fixed = mask, y[r0:r1,c0:c1], line[r0:r1,c0:c1], fc, fd
+        core = r-r0, min(r+tile,h)-r0, c-c0, min(c+tile,w)-c0
+        return f[r0:r1,c0:c1], g[r0:r1,c0:c1], offsets, lines, lo, fixed, core
+    todo = [(r,c) for r in xrange(0,h,tile) for c in xrange(0,w,tile)]
+    queued = set(todo)
+    pool = None
+    batch = 1
+    if nproc != 1 and len(todo) > 1:
+        from multiprocessing import Pool, cpu_count
+        batch = 2*(nproc or cpu_count())
+        pool = Pool(nproc)
+    try:
+        while todo:
+            cores,todo = todo[:batch],todo[batch:]
+            queued.difference_update(cores)
+            args = [window(r, c) for r,c in cores]
+            if pool is None: res = map(_wstile, args)
+            else: res = pool.map(_wstile, args)
+            del args
+            for (r,c),(yt,lt,ct,dt) in zip(cores, res):
+                th,tw = yt.shape
+                bh,bw = min(mh,th), min(mw,tw)
+                strips = [(0,0,bh,tw), (th-bh,0,bh,tw), (0,0,th,bw), (0,tw-bw,th,bw)]
+                strips = [x for x in strips if x[2] and x[3]]
+                old = band.get((r,c))
+                moved = zeros((th,tw), bool)    # the border pixels that changed
+                for i,(a,b,sh,sw) in enumerate(strips):
+                    k,d = ct[a:a+sh,b:b+sw],dt[a:a+sh,b:b+sw]
+                    if old is None: m = (k >= 0) | (d != 0)
+                    else: m = (k != old[i][2]) | (d != old[i][3])
+                    m |= y[r+a:r+a+sh, c+b:c+b+sw] != yt[a:a+sh,b:b+sw]
+                    m |= line[r+a:r+a+sh, c+b:c+b+sw] != lt[a:a+sh,b:b+sw]
+                    moved[a:a+sh,b:b+sw] |= m
+                band[(r,c)] = [(r+a, c+b, ct[a:a+sh,b:b+sw].copy(),
+                                dt[a:a+sh,b:b+sw].copy()) for a,b,sh,sw in strips]
+                y[r:r+th, c:c+tw] = yt
+                line[r:r+th, c:c+tw] = lt
+                for rr,cc in near(r, c):        # flood again the tiles that see a change
+                    a0,a1 = max(rr-mh-r,0), min(rr+tile+mh-r,th)
+                    b0,b1 = max(cc-mw-c,0), min(cc+tile+mw-c,tw)
+                    if (rr,cc) not in queued and moved[a0:a1,b0:b1].any():
+                        queued.add((rr,cc))
+                        todo.append((rr,cc))
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return y, line
+
+
+def _wstile(args):
+    """
+    y, line, level, rank = _wstile(args)
+
+    _cwshed of one tile for _tiledws , cut back to the tile; a top-level
+    function for worker pools.
+    """
+    f,g,offsets,lines,lo,fixed,(a0,a1,b0,b1) = args
+    y,line,cost,depth = _cwshed(f, g, offsets, lines, False, lo, True, fixed)
+    return y[a0:a1,b0:b1], line[a0:a1,b0:b1], cost[a0:a1,b0:b1], depth[a0:a1,b0:b1]
+
+
+def _cwshed(f, g, offsets, lines=False, arcs=False, lo=None, order=False, fixed=None):
+    """
+    y, line = _cwshed(f, g, offsets, lines=False, arcs=False, lo=None, order=False, fixed=None)
+
+    Flooding of f from the labelled markers g along the neighbour offsets
+    (dr,dc). A pixel q reached from p at the current level k costs
+    max(k, f(q)), or max(k, |f(q)-f(p)|) with arcs , and takes the label
+    of p when that is lower than its cost so far; the markers start at
+    the lowest level. The queue holds only the frontier: one FIFO per
+    level (a dense list for uint8 and uint16 node costs, a heap of the
+    levels in use otherwise), each emptied one wave at a time. Within a
+    wave the smallest label wins the ties, so the result does not depend
+    on the order of the pixels in the queue. With lines , a pixel is a
+    line pixel when it is popped next to a pixel with another label that
+    is not a line pixel itself and was popped before it, in an earlier
+    wave or in the same wave with a smaller label. The markers start at
+    lo when it is given. With order , the level of each pixel and the
+    rank of its wave within that level (-1 and 0 for the pixels never
+    reached) are returned after y and line . fixed , when given, is a
+    tuple mask, y, line, level, rank of images: the pixels of mask are
+    not flooded but keep these values, and reach their neighbours in the
+    wave of that rank at that level like the flooded pixels do (never,
+    for a level of -1). Besides f and g , the
+    flooding keeps a wave number and a level per pixel, the levels in
+    int32 for uint8 and uint16 images.
+    """
+    import numpy
+    from numpy import newaxis, zeros, empty, flatnonzero, concatenate, arange, maximum, int32
+    from heapq import heappush, heappop
+    grid = _Grid(f.shape, offsets)
+    N = grid.size
+    fp = grid.pad(f, 0)
+    lab = grid.pad(g, 0)
+    o = numpy.array(grid.o, int)
+    stamp = empty(N, int32)                 # wave popped in, N until then,
+    stamp[:] = N+1                          # N+1 outside f
+    grid.view(stamp)[:] = N
+    line = zeros(N, bool)
+    if order: depth = zeros(N, int32)
+    if lo is None: lo = arcs and 0 or int(f.min())
+    if f.dtype in [numpy.uint8, numpy.uint16]: cost = empty(N, int32)
+    else:                                      cost = empty(N, int)
+    inf = numpy.iinfo(cost.dtype).max
+    cost[:] = inf
+    groups = []                             # the fixed pixels, by level and rank
+    if fixed is not None:
+        mask,fy,fl,fc,fd = fixed
+        grid.view(stamp)[mask] = N+1
+        grid.view(lab)[mask] = fy[mask]
+        grid.view(line)[mask] = fl[mask]
+        r,c = (mask & (fc >= 0)).nonzero()
+        i = numpy.lexsort((fd[r,c], fc[r,c]))
+        r,c = r[i],c[i]
+        hc,hd = fc[r,c],fd[r,c]
+        cut = flatnonzero((hc[1:] != hc[:-1]) | (hd[1:] != hd[:-1])) + 1
+        at = concatenate([[0], cut]).astype(int)
+        if len(r):
+            hp = numpy.split(grid.index(r, c), cut)
+            groups = zip(hc[at].tolist(), hd[at].tolist(), hp)
+    seeds = flatnonzero(lab)
+    seeds = seeds[stamp[seeds] == N]
+    cost[seeds] = lo
+    if not arcs and f.dtype in [numpy.uint8, numpy.uint16]:
+        top = max([int(f.max())] + [hk for hk,hd,hp in groups])
+        buckets = [[] for k in xrange(top+1)]
+        levels = None
+    else:
+        buckets = {lo: []}
+        levels = [lo]
+        for hk,hd,hp in groups:
+            if hk not in buckets:
+                buckets[hk] = []
+                heappush(levels, hk)
+    buckets[lo].append(seeds)
+    gi = 0
+    waves = 0
+    k = lo - 1
+    while True:
+        if levels is None:
+            k += 1
+            if k >= len(buckets): break
+        else:
+            if not levels: break
+            k = heappop(levels)
+        held = gi < len(groups) and groups[gi][0] == k
+        if not buckets[k] and not held: continue
+        if buckets[k]: wave = concatenate(buckets[k])
+        else: wave = zeros(0, int)
+        buckets[k] = None
+        wave = wave[(cost[wave] == k) & (stamp[wave] == N)]
+        d = 0                               # rank of the wave within level k
+        while True:
+            held = zeros(0, int)
+            if gi < len(groups) and groups[gi][:2] == (k, d):
+                held = groups[gi][2]
+                gi += 1
+            if not len(wave) and not len(held):
+                if gi < len(groups) and groups[gi][0] == k:
+                    d = groups[gi][1]       # waves of pixels out of f
+                    continue
+                break
+            stamp[wave] = waves
+            stamp[held] = waves
+            if order: depth[wave] = d
+            q = wave[:,newaxis] + o
+            if lines:
+                lq,lp = lab[q],lab[wave][:,newaxis]
+                same = (stamp[q] == waves) & (lq < lp)
+                dep = ((stamp[q] < waves) | same) & (lq != lp)
+                same &= dep
+                dep &= ~line[q]
+                while True:                 # resolve the pixels of this wave
+                    new = (dep & ~(same & line[q])).any(1)
+                    if (new == line[wave]).all(): break
+                    line[wave] = new
+            waves += 1
+            d += 1
+            if len(held):
+                wave = concatenate([wave, held])
+                q = wave[:,newaxis] + o
+            if arcs:
+                c = abs(fp[q].astype(int) - fp[wave][:,newaxis])
+            else:
+                c = fp[q].astype(int)
+            c = maximum(c, k)
+            l = lab[wave][:,newaxis] + 0*q
+            q,l,c = q.ravel(),l.ravel(),c.ravel()
+            sel = (stamp[q] == N) & (c < cost[q])
+            q,l,c = q[sel],l[sel],c[sel]
+            if len(c) and int(c.max()) < 2**62 // (int(l.max()) + 1):
+                i = (c * (int(l.max()) + 1) + l).argsort()
+            else:
+                i = numpy.lexsort((l, c))
+            stamp[q[i][::-1]] = i[::-1]     # stamp is free until q is popped
+            sel = stamp[q] == arange(len(q))  # the cheapest, then the smallest label
+            stamp[q] = N
+            q,l,c = q[sel],l[sel],c[sel]
+            lab[q] = l
+            cost[q] = c
+            wave = q[c == k]
+            q,c = q[c > k],c[c > k]
+            if not len(q): continue
+            i = c.argsort(kind='mergesort')
+            q,c = q[i],c[i]
+            cut = flatnonzero(c[1:] != c[:-1]) + 1
+            for qq,cc in zip(numpy.split(q, cut), c[concatenate([[0], cut])]):
+                if levels is not None and cc not in buckets:
+                    buckets[cc] = []
+                    heappush(levels, cc)
+                buckets[cc].append(qq)
+    if order:
+        cost = grid.crop(cost).astype(int)
+        cost[cost == inf] = -1
+        return grid.crop(lab), grid.crop(line), cost, grid.crop(depth)
+    return grid.crop(lab), grid.crop(line)
 
 
 def dilate(f, b=None):
@@ -1863,7 +2647,11 @@ def dilate(f, b=None):
             Dilation is a fundamental operator to the construction of all
             other morphological operators, it is also called an elementary
             operator of Mathematical Morphology. When f is a gray-scale
-            image, b may be a flat or non-flat structuring element.
+            image, b may be a flat or non-flat structuring element. Flat
+            lines (horizontal, vertical or diagonal) and boxes are computed
+            by the van Herk/Gil-Werman algorithm, in a time that does not
+            depend on their size. Diamonds and octagons are decomposed
+            into chains of small structuring elements.
         - Examples
             #
             #   example 1
@@ -1898,21 +2686,187 @@ def dilate(f, b=None):
     """
     from numpy import maximum, newaxis, ones, int32
     if b is None: b = secross()
+    if isinstance(f, PackedBinary): return _packeddilate(f, b)
     if len(f.shape) == 1: f = f[newaxis,:]
     h,w = f.shape
+    plan = _seplan(b)
+    if len(plan) > 1:
+        r = (b.shape[0]-1)//2       # pad so that the chain sees the
+        y = (ones((h+2*r,w+2*r),int32) * limits(f)[0]).astype(f.dtype)
+        y[r:r+h, r:r+w] = f         # whole support of b at the border
+        for bi in plan:
+            y = dilate(y, bi)
+        return y[r:r+h, r:r+w]
     x,v = mat2set(b)
     if len(x)==0:
         y = (ones((h,w),int32) * limits(f)[0]).astype(f.dtype)
+        return y
+    lines = None
+    if isbinary(v):
+        lines = _flatlines(x)
+    if lines is not None:
+        y = f
+        for start,d,l in lines:  # van Herk/Gil-Werman, independent of l
+            y = _lineop(y, start, d, l, maximum, limits(f)[0])
     else:
         if isbinary(v):
             v = intersec(gray(v,'int32'),0)
-        mh,mw = max(abs(x)[:,0]),max(abs(x)[:,1])
-        y = (ones((h+2*mh,w+2*mw),int32) * limits(f)[0]).astype(f.dtype)
-        for i in xrange(x.shape[0]):
-            if v[i] > -2147483647:
-                y[mh+x[i,0]:mh+x[i,0]+h, mw+x[i,1]:mw+x[i,1]+w] = maximum(
-                    y[mh+x[i,0]:mh+x[i,0]+h, mw+x[i,1]:mw+x[i,1]+w], add4dilate(f,v[i]))
-        y = y[mh:mh+h, mw:mw+w]
+        y = _offsetop(f, x, v, maximum, limits(f)[0], add4dilate)
+    return y
+
+
+def _offsetop(f, x, v, op, fill, bias):
+    """
+    y = _offsetop(f, x, v, op, fill, bias)
+
+    Offset-by-offset kernel shared by dilate and erode:
+    y(q) = op{ bias(f,v[i])(q - x[i]) }, over the offsets x[i] whose
+    value v[i] is not -infinity. Pixels outside f take the value fill.
+    """
+    from numpy import ones, int32
+    h,w = f.shape
+    mh,mw = max(abs(x)[:,0]),max(abs(x)[:,1])
+    y = (ones((h+2*mh,w+2*mw),int32) * fill).astype(f.dtype)
+    for i in xrange(x.shape[0]):
+        if v[i] > -2147483647:
+            y[mh+x[i,0]:mh+x[i,0]+h, mw+x[i,1]:mw+x[i,1]+w] = op(
+                y[mh+x[i,0]:mh+x[i,0]+h, mw+x[i,1]:mw+x[i,1]+w], bias(f,v[i]))
+    return y[mh:mh+h, mw:mw+w]
+
+
+def _seplan(b):
+    """
+    plan = _seplan(b)
+
+    Factorise the structuring element b into a chain of small structuring
+    elements whose Minkowski sum is b. Flat diamonds (secross(r), sesum of
+    the elementary cross) become r elementary crosses and flat octagons
+    (sedisk(r,'2D','OCTAGON')) become a box (run as two line passes)
+    followed by (r+1)//2 elementary crosses. Any other structuring element
+    is returned as the single-element chain [b].
+    """
+    from numpy import ogrid
+    if not isbinary(b) or len(b.shape) != 2: return [b]
+    if b.shape[0] != b.shape[1] or not b.shape[0] % 2: return [b]
+    r = (b.shape[0]-1)//2
+    if r < 2: return [b]
+    i,j = ogrid[-r:r+1, -r:r+1]
+    d = abs(i) + abs(j)
+    if (b == (d <= r)).all():
+        return r*[secross(1)]
+    a,c = r//2, (r+1)//2
+    if (b == (d <= 2*a+c)).all():
+        return [sebox(a)] + c*[secross(1)]
+    return [b]
+
+
+def _flatlines(x):
+    """
+    lines = _flatlines(x)
+
+    Decompose the flat structuring element given by the offsets x (as
+    returned by mat2set) into 1-D line segments whose Minkowski sum is the
+    structuring element. Each segment is a tuple (start, d, l): l pixels
+    starting at offset start and stepping by d, one of (0,1), (1,0), (1,1)
+    or (1,-1). Boxes give one horizontal and one vertical segment.
+    Returns None if the structuring element is not a line nor a box, or if
+    it is too small for the decomposition to pay off.
+    """
+    n = len(x)
+    if n < 3: return None
+    r0,c0 = x.min(0)
+    r1,c1 = x.max(0)
+    if n == (r1-r0+1)*(c1-c0+1):
+        if r0 == r1: return [((r0,c0),(0,1),n)]
+        if c0 == c1: return [((r0,c0),(1,0),n)]
+        return [((0,c0),(0,1),c1-c0+1), ((r0,0),(1,0),r1-r0+1)]
+    if (r1-r0+1) != n or (c1-c0+1) != n:
+        return None
+    x = x[x[:,0].argsort()]
+    k = x[:,0] - r0
+    if (x[:,1] == c0 + k).all():
+        return [((r0,c0),(1,1),n)]
+    if (x[:,1] == c1 - k).all():
+        return [((r0,c1),(1,-1),n)]
+    return None
+
+
+def _lineop(f, start, d, l, op, fill):
+    """
+    y = _lineop(f, start, d, l, op, fill)
+
+    Compute y(q) = op{ f(q - start - k*d) : k = 0..l-1 }, where op is
+    numpy.maximum (dilation) or numpy.minimum (erosion) and pixels outside
+    the image take the value fill. Diagonal lines are sheared into rows so
+    that every direction is handled by the same 1-D row filter.
+    """
+    from numpy import arange, empty
+    h,w = f.shape
+    sr,sc = start
+    if d == (0,1):
+        g,a,c = f,sc,sr
+    elif d == (1,0):
+        g,a,c = f.T,sr,sc
+    else:
+        rows = arange(h)[:,None] + 0*arange(w)[None,:]
+        if d == (1,1):
+            perp = arange(w)[None,:] - rows + (h-1)
+            c = sc - sr
+        else:
+            perp = arange(w)[None,:] + rows
+            c = sc + sr
+        g = empty((w+h-1,h), f.dtype)
+        g[:] = fill
+        g[perp,rows] = f
+        a = sr
+    y = _vhgw(g, l, -a-(l-1), op, fill)
+    y = _translate(y, c, fill)
+    if d == (0,1):
+        return y
+    elif d == (1,0):
+        return y.T.copy()
+    return y[perp,rows]
+
+
+def _vhgw(g, l, lo, op, fill):
+    """
+    y = _vhgw(g, l, lo, op, fill)
+
+    van Herk/Gil-Werman running filter along the rows of g:
+    y[:,i] = op(g[:,i+lo], ..., g[:,i+lo+l-1]), with fill outside g. The
+    padded rows are cut in blocks of l pixels; the prefix and suffix
+    accumulations inside each block answer any window with a single op.
+    """
+    from numpy import empty
+    n0,n = g.shape
+    m = -(-(n+l-1)//l) * l
+    p = empty((n0,m), g.dtype)
+    p[:] = fill
+    t0,t1 = max(0,-lo), min(m,n-lo)
+    if t1 > t0:
+        p[:,t0:t1] = g[:,lo+t0:lo+t1]
+    blocks = p.reshape(n0,m//l,l)
+    pre = op.accumulate(blocks, axis=2).reshape(n0,m)
+    suf = op.accumulate(blocks[:,:,::-1], axis=2)[:,:,::-1].reshape(n0,m)
+    return op(suf[:,:n], pre[:,l-1:l-1+n])
+
+
+def _translate(f, c, fill):
+    """
+    y = _translate(f, c, fill)
+
+    Translate f by c pixels along its first axis: y[i] = f[i-c], with fill
+    for the pixels that come from outside f.
+    """
+    from numpy import empty_like
+    if c == 0: return f
+    n = f.shape[0]
+    y = empty_like(f)
+    y[:] = fill
+    if c > 0:
+        if c < n: y[c:] = f[:n-c]
+    elif -c < n:
+        y[:n+c] = f[-c:]
     return y
 
 
@@ -2175,12 +3129,59 @@ def erode(f, b=None):
             show(f)
             show(erode(f,b))
     """
-
+    from numpy import minimum, newaxis, ones, int32
     if b is None: b = secross()
-    y = neg(dilate(neg(f),sereflect(b)))
+    if isinstance(f, PackedBinary): return _packederode(f, b)
+    if len(f.shape) == 1: f = f[newaxis,:]
+    h,w = f.shape
+    k2 = limits(f)[1]
+    plan = _seplan(b)
+    if len(plan) > 1:
+        r = (b.shape[0]-1)//2
+        y = (ones((h+2*r,w+2*r),int32) * k2).astype(f.dtype)
+        y[r:r+h, r:r+w] = f
+        for bi in plan:
+            y = erode(y, bi)
+        return y[r:r+h, r:r+w]
+    x,v = mat2set(b)
+    if len(x)==0:
+        y = (ones((h,w),int32) * k2).astype(f.dtype)
+        return y
+    x = -x                          # reflection of b, by index negation
+    lines = None
+    if isbinary(v):
+        lines = _flatlines(x)
+    if lines is not None:
+        y = f
+        for start,d,l in lines:
+            y = _lineop(y, start, d, l, minimum, k2)
+    else:
+        if isbinary(v):
+            v = intersec(gray(v,'int32'),0)
+        y = _offsetop(f, x, v, minimum, k2, _sub4erode)
     return y
 
 
+def _sub4erode(f, c):
+    """
+    a = _sub4erode(f, c)
+
+    Subtraction for erosion, the dual of add4dilate: f - c with
+    saturation, where the pixels at the maximum value of f are kept.
+    """
+    from numpy import asarray, minimum, maximum
+
+    if c:
+       y = asarray(f,'d') - c
+       k1,k2 = limits(f)
+       y = ((f==k2) * k2) + ((f!=k2) * y)
+       y = maximum(minimum(y,k2),k1)
+       a = y.astype(f.dtype)
+    else:
+       a = f
+    return a
+
+
 def freedom(L=5):
     """
         - Purpose
@@ -2260,7 +3261,13 @@ def gdist(f, g, Bc=None, METRIC=None):
             consistent with the metrics adopted to measure their length. In
             the case of the Euclidean distance, the space is considered
             continuos and, in the other cases, the connectivity is the one
-            defined by Bc .
+            defined by Bc . The distance is propagated from g inside f by a
+            bucket queue, one wavefront at a time: unit steps along the
+            offsets of a flat Bc , steps costing -Bc(x) for a non-flat
+            (int32) Bc , and for 'EUCLIDEAN' the 5-7 chamfer approximation
+            of the Euclidean length over the 3x3 neighbourhood, whatever Bc
+            is, rounded to the nearest integer. Pixels outside f or not
+            reached get 65535.
         - Examples
             #
             #   example 1
@@ -2292,8 +3299,31 @@ def gdist(f, g, Bc=None, METRIC=None):
             dtshow(y,200)
     """
 
+    from string import upper
+    from numpy import asarray, newaxis
     if Bc is None: Bc = secross()
-    assert METRIC is None,'Does not support EUCLIDEAN'
+    if METRIC is not None:
+        METRIC = upper(METRIC)
+        assert METRIC == 'EUCLIDEAN','METRIC should be EUCLIDEAN or None'
+    if isbinary(Bc):
+        x,v = mat2set(Bc)
+        steps = [(dr,dc,1) for dr,dc in x if dr or dc]
+    else:
+        x,v = mat2set(Bc)
+        steps = [(dr,dc,-int(vi)) for (dr,dc),vi in zip(x,v) if dr or dc]
+    if METRIC == 'EUCLIDEAN':              # the 3x3 chamfer mask, whatever Bc
+        steps = [(dr,dc,abs(dr)+abs(dc) == 1 and 5 or 7)
+                 for dr in [-1,0,1] for dc in [-1,0,1] if dr or dc]
+    if min([c for dr,dc,c in steps] + [1]) > 0:
+        f,g = asarray(f),asarray(g)
+        if len(f.shape) == 1: f,g = f[newaxis,:],g[newaxis,:]
+        d = _gdist(f != 0, (g != 0) & (f != 0), steps)
+        out = (d < 0) | (f == 0)
+        if METRIC == 'EUCLIDEAN':
+            d = (2*d + 5)//10
+        y = to_uint16(d)
+        y[out] = 65535
+        return y
     fneg,gneg = neg(f),neg(g)
     y = gray(gneg,'uint16',1)
     ero = intersec(y,0)
@@ -2308,6 +3338,50 @@ def gdist(f, g, Bc=None, METRIC=None):
     return y
 
 
+def _gdist(m, seeds, steps):
+    """
+    d = _gdist(m, seeds, steps)
+
+    Geodesic distance inside the binary mask m from the seed pixels, where
+    q reaches q+(dr,dc) back for a cost c > 0 for each step (dr,dc,c):
+    d(q) = min d(q+(dr,dc)) + c over the pixels q of m . Unreached pixels
+    get -1. The costs are small integers, so the queue is a list of
+    buckets indexed by distance, and the wavefront of each bucket is
+    relaxed at once for every step.
+    """
+    from numpy import zeros, empty, flatnonzero, concatenate, arange
+    grid = _Grid(m.shape, steps)
+    mp = grid.pad(m, 0, bool)
+    sp = grid.pad(seeds, 0, bool)
+    inf = 2**62
+    d = zeros(grid.size, int) + inf
+    tag = empty(grid.size, int)
+    front = flatnonzero(sp)
+    d[front] = 0
+    buckets = [[front]]
+    pending = 1
+    k = -1
+    while pending:
+        k += 1
+        if not buckets[k]: continue
+        p = concatenate(buckets[k])
+        pending -= len(buckets[k])
+        buckets[k] = None
+        p = p[d[p] == k]                    # drop the entries improved since
+        tag[p] = arange(len(p))
+        p = p[tag[p] == arange(len(p))]
+        for (dr,dc,c),o in zip(steps, grid.o):
+            q = p - o
+            q = q[mp[q] & (d[q] > k + c)]
+            if not len(q): continue
+            d[q] = k + c
+            while len(buckets) <= k + c: buckets.append([])
+            buckets[k + c].append(q)
+            pending += 1
+    d[d == inf] = -1
+    return grid.crop(d)
+
+
 def gradm(f, Bdil=None, Bero=None):
     """
         - Purpose
@@ -2389,7 +3463,9 @@ def grain(fr, f, measurement, option="image"):
             value, or ('data') a double column vector. In this case, the
             first element (index 1) is the measurement of region 1. The
             region with label zero is not measure as it is normally the
-            background.
+            background. 'std' is normalized by N-1 and 'std1' by N. All
+            regions are measured in one pass over the pixels grouped by
+            label.
         - Examples
             #
             #   example 1
@@ -2409,59 +3485,52 @@ def grain(fr, f, measurement, option="image"):
             show(f)
             show(g)
     """
-    from numpy import newaxis, ravel, zeros, sum, nonzero, put, take, array, mean, std
+    import numpy
+    from numpy import newaxis, ravel, zeros, bincount, argsort, cumsum, flatnonzero, sqrt, maximum, minimum, add
     from string import upper
 
     measurement = upper(measurement)
     option      = upper(option)
     if len(fr.shape) == 1:
         fr = fr[newaxis,:]
-    n = fr.max()
-    if option == 'DATA': y = []
-    else               : y = zeros(fr.shape)
+    n = int(fr.max())
+    lbl = ravel(fr).astype(int)
+    order = argsort(lbl, kind='mergesort')  # group the pixels by label
+    v = ravel(f)[order]
+    area = bincount(lbl, minlength=n+1)
+    present = flatnonzero(area[1:]) + 1
+    start = (cumsum(area) - area)[present]
+    y = None
     if measurement == 'MAX':
-        for i in xrange(1,n+1):
-            aux = (fr==i)
-            val = (aux*f).max()
-            if option == 'DATA': y.append(val)
-            else               : put(ravel(y), nonzero(ravel(aux)), val)
+        y = zeros(n+1, f.dtype)
+        y[present] = maximum.reduceat(v, start)
     elif measurement == 'MIN':
-        for i in xrange(1,n+1):
-            aux = fr==i
-            lin = ravel(aux*f)
-            ind = nonzero(ravel(aux))
-            val = take(lin,ind).min()
-            if option == 'DATA': y.append(val)
-            else               : put(ravel(y), ind, val)
+        y = zeros(n+1, f.dtype)
+        y[present] = minimum.reduceat(v, start)
     elif measurement == 'SUM':
-        for i in xrange(1,n+1):
-            aux = fr==i
-            val = (aux*f).sum()
-            if option == 'DATA': y.append(val)
-            else               : put(ravel(y), nonzero(ravel(aux)), val)
-    elif measurement == 'MEAN':
-        for i in xrange(1,n+1):
-            aux = fr==i
-            ind = nonzero(ravel(aux))
-            val = take(ravel(aux*f), ind).mean()
-            if option == 'DATA': y.append(val)
-            else               : put(ravel(y), ind, val)
-    elif measurement == 'STD':
-        for i in xrange(1,n+1):
-            aux = fr==i
-            ind = nonzero(ravel(aux))
-            v   = take(ravel(aux*f), ind)
-            if len(v) < 2: val = 0
-            else         : val = std(v)
-            if option == 'DATA': y.append(val)
-            else               : put(ravel(y), ind, val)
-    elif measurement == 'STD1':
-        print "'STD1' is not implemented"
+        acc = zeros(0, f.dtype).sum().dtype
+        y = zeros(n+1, acc)
+        y[present] = add.reduceat(v, start, dtype=acc)
+    elif measurement in ('MEAN', 'STD', 'STD1'):
+        y = zeros(n+1)
+        y[present] = add.reduceat(v, start, dtype=float) / area[present]
+        if measurement != 'MEAN':
+            d = v - y[lbl[order]]
+            ss = add.reduceat(d*d, start)
+            N = area[present]
+            y = zeros(n+1)
+            if measurement == 'STD':
+                y[present] = sqrt(ss / maximum(N - 1, 1))
+            else:
+                y[present] = sqrt(ss / N)
     else:
         print "Measurement should be 'MAX', 'MIN', 'MEAN', 'SUM', 'STD', 'STD1'."
     if option == 'DATA':
-        y = array(y)
-        if len(y.shape) == 1: y = y[:,newaxis]
+        if y is None: y = zeros(0)
+        y = y[1:,newaxis]
+    else:
+        if y is None: y = zeros(n+1)
+        y = y.astype(float)[lbl].reshape(fr.shape)
     return y
 
 
@@ -2516,7 +3585,8 @@ def hmin(f, h=1, Bc=None):
         - Synopsis
             y = hmin(f, h=1, Bc=None)
         - Input
-            f:  Gray-scale (uint8 or uint16) image.
+            f:  Gray-scale (uint8 or uint16) image, or its min-tree
+                (ComponentTree).
             h:  Default: 1. Contrast parameter.
             Bc: Structuring Element Default: None (3x3 elementary cross).
                 Structuring element (connectivity).
@@ -2549,6 +3619,10 @@ def hmin(f, h=1, Bc=None):
     """
 
     if Bc is None: Bc = secross()
+    if isinstance(f, ComponentTree):
+        assert f.dual,'hmin needs a min-tree'
+        k2 = limits(f)[1]
+        return f.reconstruct((f.level + (h - f.height).clip(0)).clip(0,k2))
     g = addm(f,h)
     y = suprec(g,f,Bc);
     return y
@@ -2561,7 +3635,8 @@ def vmax(f, v=1, Bc=None):
         - Synopsis
             y = vmax(f, v=1, Bc=None)
         - Input
-            f:  Gray-scale (uint8 or uint16) image.
+            f:  Gray-scale (uint8 or uint16) image, or its max-tree
+                (ComponentTree).
             v:  Default: 1. Volume parameter.
             Bc: Structuring Element Default: None (3x3 elementary cross).
                 Structuring element (connectivity).
@@ -2571,7 +3646,11 @@ def vmax(f, v=1, Bc=None):
             vmax This operator removes connected domes with volume less
             than v . This function is very similar to hmax , but instead
             of using a gray scale criterion (contrast) for the dome, it uses
-            a volume criterion.
+            a volume criterion. The volume of a dome cut at level l is
+            sum(f(p)-l+1) over its pixels, and each dome is cut at the
+            highest level where its volume is at least v . It is the dual
+            of flood(f,v,'VOLUME') and is computed with one pass over the
+            max-tree of f .
         - Examples
             #
             #   example 1
@@ -2592,10 +3671,21 @@ def vmax(f, v=1, Bc=None):
             show(regmax(fb))
     """
 
+    from numpy import where, arange, floor
     if Bc is None: Bc = secross()
-    raise 'Not implemented yet'
-    return None
-    return y
+    if isinstance(f, ComponentTree):
+        assert not f.dual,'vmax needs a max-tree'
+        t = f
+    else:
+        t = ComponentTree(f,Bc)
+    L, area = t.level, t.area
+    isroot = (t.parent == arange(len(L)))
+    Lp = where(isroot, -1, L[t.parent])      # dome of a node lives in (Lp, L]
+    S = t.volume + (L - 1)*area              # sum of f over the dome
+    c = floor((S - v)/area).astype(int) + 1
+    c = c.clip(max=L)
+    c = where(c > Lp, c, 0)
+    return t.reconstruct(c)
 
 
 def hmax(f, h=1, Bc=None):
@@ -2605,7 +3695,8 @@ def hmax(f, h=1, Bc=None):
         - Synopsis
             y = hmax(f, h=1, Bc=None)
         - Input
-            f:  Gray-scale (uint8 or uint16) image.
+            f:  Gray-scale (uint8 or uint16) image, or its max-tree
+                (ComponentTree).
             h:  Default: 1. Contrast parameter.
             Bc: Structuring Element Default: None (3x3 elementary cross).
                 Structuring element ( connectivity).
@@ -2637,6 +3728,9 @@ def hmax(f, h=1, Bc=None):
     """
 
     if Bc is None: Bc = secross()
+    if isinstance(f, ComponentTree):
+        assert not f.dual,'hmax needs a max-tree'
+        return f.reconstruct((f.level - (h - f.height).clip(0)).clip(0))
     g = subm(f,h)
     y = infrec(g,f,Bc);
     return y
@@ -2781,6 +3875,11 @@ def infcanon(f, Iab, theta=45, DIRECTION="CLOCKWISE"):
     from string import upper
 
     DIRECTION = upper(DIRECTION)            
+    rots = [interot(Iab, t, DIRECTION) for t in xrange(0,360,theta)]
+    packed = isinstance(f, PackedBinary)     # stays on the word-parallel path
+    bits = [isbinary(f) and not packed and _hmtbits(A, Bc) for A,Bc in rots]
+    if all(bits):
+        return ~_hmt(f, map(_hmtdual, bits))
     y = union(f,1)
     for t in xrange(0,360,theta):
         Irot = interot( Iab, t, DIRECTION )
@@ -2807,10 +3906,25 @@ def infgen(f, Iab):
     """
 
     A,Bc = Iab
+    bits = isbinary(f) and not isinstance(f, PackedBinary) and _hmtbits(A, Bc)
+    if bits:
+        return ~_hmt(f, [_hmtdual(bits)])
     y = union(dilate(f, A),dilate(neg(f), Bc))
     return y
 
 
+def _hmtdual(bits):
+    """
+    bits = _hmtdual(bits)
+
+    The masks (fg, bg) of _hmtbits for the complement of the inf-generating
+    operator: the reflected Bc must be 1 and the reflected A must be 0.
+    """
+    fg,bg = bits
+    reflect = lambda m: sum([((m >> k) & 1) << (8-k) for k in xrange(9)])
+    return reflect(bg), reflect(fg)
+
+
 def infrec(f, g, bc=None):
     """
         - Purpose
@@ -2830,7 +3944,8 @@ def infrec(f, g, bc=None):
             iterations (iterations until stability) of the dilation of f by
             bc conditioned to g . We say the y is the inf-reconstruction of
             g from the marker f . For algorithms and applications, see
-            Vinc:93b .
+            Vinc:93b . With a flat bc, the hybrid algorithm of Vinc:93b is
+            used: a raster scan, an anti-raster scan and a FIFO queue.
         - Examples
             #
             #   example 1
@@ -2856,11 +3971,83 @@ def infrec(f, g, bc=None):
     """
     from numpy import product
     if bc is None: bc = secross()
+    if isbinary(bc) and (f.dtype == g.dtype):
+        return _hybridrec(f, g, bc, 0)
     n = product(f.shape)
     y = cdilate(f,g,bc,n);
     return y
 
 
+def _hybridrec(f, g, bc, dual):
+    """
+    y = _hybridrec(f, g, bc, dual)
+
+    Hybrid reconstruction (Vinc:93b) of g from the marker f, by dilation
+    (infrec) or, if dual, by erosion (suprec), with the flat connectivity
+    bc. A raster and an anti-raster scan are followed by a FIFO
+    propagation from the pixels that can still improve a neighbour. The
+    scans visit the image by wavefronts of pixels that do not depend on
+    each other, so that each wavefront is a vectorised step, and the FIFO
+    is processed one breadth-first level at a time.
+    """
+    import numpy
+    from numpy import newaxis, arange, empty, concatenate, bincount, cumsum, split
+    if len(f.shape) == 1: f = f[newaxis,:]
+    if len(g.shape) == 1: g = g[newaxis,:]
+    if dual: grow,clamp,better,k = numpy.minimum,numpy.maximum,numpy.less,limits(f)[1]
+    else:    grow,clamp,better,k = numpy.maximum,numpy.minimum,numpy.greater,limits(f)[0]
+    h,w = f.shape
+    x,v = mat2set(bc)
+    x = [(dr,dc) for dr,dc in x if dr or dc]
+    if not x:
+        return clamp(f,g).astype(f.dtype)
+    if not dual: x = [(-dr,-dc) for dr,dc in x]
+    grid = _Grid((h,w), x)
+    y = grid.pad(clamp(f,g), k, f.dtype)
+    gg = grid.pad(g, k, f.dtype)            # the frame never changes
+    pull = grid.o                       # y(p) depends on y(p + pull)
+    push = [-o for o in pull]
+    prior = [o for o in pull if o < 0]
+    post  = [o for o in pull if o > 0]
+    a = max([dc//(-dr)+1 for dr,dc in x if dr < 0] + [1])
+                                    # a*i + j grows along every prior offset
+    i,j = arange(h)[:,newaxis], arange(w)[newaxis,:]
+    wave = (a*i + j).ravel()
+    pix = grid.index(i, j).ravel()
+    order = wave.argsort(kind='mergesort')
+    fronts = split(pix[order], cumsum(bincount(wave))[:-1])
+    for P in fronts:                # raster scan
+        t = y[P]
+        for o in prior: t = grow(t, y[P+o])
+        y[P] = clamp(t, gg[P])
+    for P in fronts[::-1]:          # anti-raster scan
+        t = y[P]
+        for o in post: t = grow(t, y[P+o])
+        y[P] = clamp(t, gg[P])
+    mark = numpy.zeros(len(pix), bool)
+    for o in push:
+        q = pix + o
+        mark |= better(y[pix], y[q]) & (y[q] != gg[q])
+    fifo = pix[mark]
+    last = empty(grid.size, int)
+    while len(fifo):                # FIFO propagation, level by level
+        nxt = []
+        for o in push:              # fifo holds no duplicates, nor fifo + o
+            q = fifo + o
+            t = clamp(y[fifo], gg[q])
+            upd = better(t, y[q])
+            if upd.any():
+                q = q[upd]
+                y[q] = t[upd]
+                nxt.append(q)
+        if not nxt: break
+        fifo = concatenate(nxt)
+        n = arange(len(fifo))
+        last[fifo] = n
+        fifo = fifo[last[fifo] == n]
+    return grid.crop(y)
+
+
 def inpos(f, g, bc=None):
     """
         - Purpose
@@ -2974,8 +4161,14 @@ def intersec(f1, f2, f3=None, f4=None, f5=None):
             show(f)
             show(g)
     """
-    from numpy import minimum
+    from numpy import minimum, bitwise_and
 
+    p = _anypacked(f1, f2, f3, f4, f5)
+    if p is not None:
+        y = _topacked(f1, p)
+        for fi in (f2,f3,f4,f5):
+            if fi is not None: y = _packedop(bitwise_and, y, fi)
+        return y
     y = minimum(f1,f2)
     if f3 != None: y = minimum(y,f3)
     if f4 != None: y = minimum(y,f4)
@@ -3071,6 +4264,9 @@ def isequal(f1, f2):
     import numpy
     if f1.shape != f2.shape:
         return False
+    p = _anypacked(f1, f2)
+    if p is not None:
+        return numpy.all(_topacked(f1, p).words == _topacked(f2, p).words)
     return numpy.all(f1 == f2)
 
 
@@ -3097,7 +4293,10 @@ def labelflat(f, Bc=None, _lambda=0):
             zone is detected where two neighboring pixels belong to the same
             region if their difference gray-levels is smaller or equal
             lambda . The minimum label of the output image is 1 and the
-            maximum is the number of flat-zones in the image.
+            maximum is the number of flat-zones in the image. Zones are
+            found in a single union-find pass over the neighbour pairs;
+            quasi-flat zones of a non-symmetric Bc use the symmetric
+            neighbourhood of Bc and its reflection.
         - Examples
             #
             #   example 1
@@ -3127,15 +4326,26 @@ def labelflat(f, Bc=None, _lambda=0):
             show(f)
             lblshow(g)
     """
-    from numpy import allclose, ravel, nonzero, array
+    from numpy import allclose, ravel, nonzero, array, ones
     if Bc is None: Bc = secross()
+    offsets = _symoffsets(Bc)
+    if offsets is None and _lambda != 0 and isbinary(Bc):
+        x,v = mat2set(Bc)
+        offsets = sorted(set([(dr,dc) for dr,dc in x if dr or dc] +
+                             [(-dr,-dc) for dr,dc in x if dr or dc]))
+    if offsets is not None:
+        if _lambda == 0:
+            link = lambda a,b: a == b
+        else:
+            link = lambda a,b: abs(a.astype(int) - b) <= _lambda
+        return _labelcc(f, ones(f.shape, bool), offsets, link)
     zero = binary(subm(f,f))       # zero image
     faux = neg(zero)
     r = array(zero)
     label = 1
     y = gray( zero,'uint16',0)          # zero image (output)
     while not allclose(faux,0):
-        x=nonzero(ravel(faux))[0]        # get first unlabeled pixel
+        x=nonzero(ravel(faux))[0][0]     # get first unlabeled pixel
         fmark = array(zero)
         fmark.flat[x] = 1                # get the first unlabeled pixel
         f2aux = (f == ravel(f)[x])
@@ -3471,11 +4681,11 @@ def patspec(f, type='OCTAGON', n=65535, Bc=None, Buser=None):
         - Synopsis
             h = patspec(f, type='OCTAGON', n=65535, Bc=None, Buser=None)
         - Input
-            f:     Binary image.
+            f:     Binary image, or a ComponentTree for 'AREA'.
             type:  String Default: 'OCTAGON'. Disk family: 'OCTAGON',
                    'CHESSBOARD', 'CITY-BLOCK', 'LINEAR-V', 'LINEAR-H',
-                   'LINEAR-45R', 'LINEAR-45L', 'USER'.
-            n:     Default: 65535. Maximum disk radii.
+                   'LINEAR-45R', 'LINEAR-45L', 'USER', or 'AREA'.
+            n:     Default: 65535. Maximum disk radii (areas for 'AREA').
             Bc:    Structuring Element Default: None (3x3 elementary cross).
                    Connectivity for the reconstructive granulometry. Used if
                    '-REC' suffix is appended in the 'type' string.
@@ -3487,13 +4697,20 @@ def patspec(f, type='OCTAGON', n=65535, Bc=None, Buser=None):
         - Description
             Compute the Pattern Spectrum of a binary image. See Mara:89b .
             The pattern spectrum is the histogram of the open transform, not
-            taking the zero values.
+            taking the zero values. With 'AREA', or when f is a
+            ComponentTree, the spectrum is that of the area openings (area
+            closings for a min-tree) with connectivity Bc : element a-1 is
+            the volume removed between the area openings of sizes a and a+1.
 
     """
-
+    from string import upper
     if Bc is None: Bc = secross()
     if Buser is None: Buser = secross()
+    if isinstance(f, ComponentTree):
+        return f.areaspec()[:n]
     assert isbinary(f),'Error: input image is not binary'
+    if upper(type) == 'AREA':
+        return ComponentTree(gray(f,'uint8',1),Bc).areaspec()[:n]
     g=opentransf(f,type,n,Bc,Buser)
     h=histogram(g)
     h=h[1:]
@@ -4095,7 +5312,9 @@ def sereflect(Bi):
             b2 = sereflect(b1)
             print seshow(b2)
     """
-    Bo = serot(Bi, 180)
+    x,v = mat2set(Bi)
+    if len(x)==0: return binary([0])
+    Bo = set2mat((-x,v))
     return Bo
 
 
@@ -4366,7 +5585,12 @@ def skiz(f, Bc=None, LINEREG="LINES", METRIC=None):
             LINEREG, y will be a binary image with the skiz lines or a
             labeled image representing the zone of influence regions. When
             the connected objects of f are single points, the skiz is the
-            Voronoi diagram.
+            Voronoi diagram. For a symmetric flat Bc , the labels of the
+            objects are propagated by a FIFO queue, one distance at a time,
+            or, with 'EUCLIDEAN', taken from the nearest object pixel found
+            by the exact distance transform. A pixel is a skiz line pixel
+            when a neighbour with another label is nearer to its object (or
+            as near, with a smaller label) and is not itself a line pixel.
         - Examples
             #
             #   example 1
@@ -4384,24 +5608,81 @@ def skiz(f, Bc=None, LINEREG="LINES", METRIC=None):
             show(f,y)
     """
     from string import upper
+    from numpy import asarray, newaxis, zeros, uint8
     if Bc is None: Bc = secross()
-    LINEREG = upper(LINEREG)
+    LINEREG = upper(LINEREG).strip()
     if METRIC is not None: METRIC = upper(METRIC)
-    d = dist( neg(f), Bc, METRIC)
-    return cwatershed(d,f,Bc,LINEREG)
-    return y
-
-def subm(f1, f2):
+    offsets = _symoffsets(Bc)
+    if offsets is None:
+        d = dist( neg(f), Bc, METRIC)
+        return cwatershed(d,f,Bc,LINEREG)
+    assert LINEREG in ['LINES','REGIONS'],'LINEREG should be LINES or REGIONS'
+    g = asarray(label(f,Bc))
+    shape = g.shape
+    if len(shape) == 1: g = g[newaxis,:]
+    if METRIC == 'EUCLIDEAN':
+        d2,y = dist(g == 0, None, 'EUC2', LABELS=g)
+        if LINEREG == 'LINES':
+            return binary(_zoneline(d2, y, offsets)).reshape(shape)
+    else:
+        y,line = _cwshed(zeros(g.shape, uint8), g, offsets, LINEREG == 'LINES')
+        if LINEREG == 'LINES':
+            return binary(line).reshape(shape)
+    return y.astype(g.dtype).reshape(shape)
+
+
+def _zoneline(d, y, offsets):
+    """
+    line = _zoneline(d, y, offsets)
+
+    Boundaries of the zones of the label image y , where d is the distance
+    to the zone seeds: a pixel is a line pixel when a neighbour with
+    another label comes before it in the order of (d, label) and is not a
+    line pixel itself. The pixels with such a neighbour are resolved all
+    at once, then again wherever a neighbour changed, until nothing does.
+    """
+    from numpy import newaxis, zeros, flatnonzero, arange, array
+    grid = _Grid(y.shape, offsets)
+    dp = grid.pad(d, 0)
+    lab = grid.pad(y, 0)
+    inside = grid.inside()
+    edge = grid.pad(y, 0, bool)
+    for dr,dc in offsets:
+        grid.view(edge)[:] |= grid.view(inside, dr, dc) & (grid.view(lab, dr, dc) != y)
+    p = flatnonzero(edge)
+    o = array(grid.o, int)
+    q = p[:,newaxis] + o
+    dq,lq = dp[q],lab[q]
+    dpp,lp = dp[p][:,newaxis],lab[p][:,newaxis]
+    dep = inside[q] & (lq != lp) & ((dq < dpp) | ((dq == dpp) & (lq < lp)))
+    pos = zeros(grid.size, int) - 1
+    pos[p] = arange(len(p))
+    line = zeros(grid.size, bool)
+    redo = zeros(len(p), bool)
+    i = arange(len(p))
+    while len(i):                           # redo the pixels whose neighbours changed
+        new = (dep[i] & ~line[q[i]]).any(1)
+        r = p[i][new != line[p[i]]]
+        line[r] = ~line[r]
+        r = pos[(r[:,newaxis] - o).ravel()]
+        redo[r[r >= 0]] = 1
+        i = flatnonzero(redo)
+        redo[i] = 0
+    return grid.crop(line)
+
+def subm(f1, f2, out=None):
     """
         - Purpose
             Subtraction of two images, with saturation.
         - Synopsis
-            y = subm(f1, f2)
+            y = subm(f1, f2, out=None)
         - Input
-            f1: Unsigned gray-scale (uint8 or uint16), signed (int32) or
-                binary image.
-            f2: Unsigned gray-scale (uint8 or uint16), signed (int32) or
-                binary image. Or constant.
+            f1:  Unsigned gray-scale (uint8 or uint16), signed (int32) or
+                 binary image.
+            f2:  Unsigned gray-scale (uint8 or uint16), signed (int32) or
+                 binary image. Or constant.
+            out: Image. Default: None. Output buffer, with the datatype of
+                 f1 and the shape of the result.
         - Output
             y: Unsigned gray-scale (uint8 or uint16), signed (int32) or
                binary image.
@@ -4410,7 +5691,10 @@ def subm(f1, f2):
             f2 from the image f1 . When the subtraction of the values of two
             pixels is negative, 0 is taken as the result of the subtraction.
             When f1 and f2 are binary images, y represents the set
-            subtraction of f2 from f1 .
+            subtraction of f2 from f1 . When f2 is an image of the same
+            datatype as f1 or an integer constant, the subtraction is
+            computed in the datatype of f1 (int32 images are widened to 64
+            bits).
         - Examples
             #
             #   example 1
@@ -4432,11 +5716,19 @@ def subm(f1, f2):
     """
     from numpy import array, clip
 
+    p = _anypacked(f1, f2)
+    if p is not None:
+        return _packed(_topacked(f1, p).words & ~_topacked(f2, p).words, p.shape)
     if type(f2) is array:
         assert f1.dtype == f2.dtype, 'Cannot have different datatypes:'
-    bottom,top=limits(f1)
-    y = clip(f1.astype('d') - f2, bottom, top)
-    y = y.astype(f1.dtype)
+    y = _satarith(f1, f2, 1, out)
+    if y is None:
+        bottom,top=limits(f1)
+        y = clip(f1.astype('d') - f2, bottom, top)
+        y = y.astype(f1.dtype)
+        if out is not None:
+            out[...] = y
+            y = out
     return y
 
 
@@ -4460,12 +5752,19 @@ def supcanon(f, Iab, theta=45, DIRECTION="CLOCKWISE"):
             transformations of the image f by sup-generating operators.
             These hit-miss operators are characterized by rotations (in the
             clockwise or anti-clockwise direction) of theta degrees of the
-            interval Iab .
+            interval Iab . When f is binary and every rotation is a flat
+            3x3 interval, a single lookup table holds all the rotations and
+            the image is scanned once.
 
     """
     from string import upper
 
     DIRECTION = upper(DIRECTION)            
+    rots = [interot(Iab, t, DIRECTION) for t in xrange(0,360,theta)]
+    packed = isinstance(f, PackedBinary)     # stays on the word-parallel path
+    bits = [isbinary(f) and not packed and _hmtbits(A, Bc) for A,Bc in rots]
+    if all(bits):
+        return _hmt(f, bits)
     y = intersec(f,0)
     for t in xrange(0,360,theta):
         Irot = interot( Iab, t, DIRECTION )
@@ -4492,7 +5791,10 @@ def supgen(f, INTER):
             a shape is that it be inside the interval Iab . Note that we
             have the classical template matching when a=b . Note yet that
             the sup-generating operator is equivalent to the classical
-            hit-miss operator.
+            hit-miss operator. For a binary f and a flat interval within
+            3x3, the 3x3 neighbourhood of each pixel is packed into a 9-bit
+            code and looked up in a 512-entry table of the codes the
+            interval accepts.
         - Examples
             #
             #   example 1
@@ -4515,11 +5817,71 @@ def supgen(f, INTER):
     """
 
     A,Bc = INTER
+    bits = isbinary(f) and not isinstance(f, PackedBinary) and _hmtbits(A, Bc)
+    if bits:
+        return _hmt(f, [bits])
     y = intersec(erode(f,A),
                    erode(neg(f),Bc))
     return y
 
 
+def _hmtbits(A, Bc):
+    """
+    bits = _hmtbits(A, Bc)
+
+    The interval (A,Bc) as a pair of 9-bit masks (fg, bg) of the 3x3
+    neighbourhood, with bit 3*(dr+1)+(dc+1) for the offset (dr,dc): the
+    positions that must be 1 (A) and 0 (Bc). None when A or Bc is not
+    flat or reaches beyond the 3x3 neighbourhood.
+    """
+    bits = []
+    for B in [A, Bc]:
+        if not isbinary(B): return None
+        x,v = mat2set(B)
+        if len(x) and abs(x).max() > 1: return None
+        bits.append(sum([1 << (3*(dr+1) + dc+1) for dr,dc in x]))
+    return tuple(bits)
+
+
+def _hmt(f, intervals):
+    """
+    y = _hmt(f, intervals)
+
+    Union of the hit-or-miss transforms of the binary image f by the 3x3
+    intervals, given as (fg, bg) masks from _hmtbits. The neighbourhood
+    of each pixel is packed into a 9-bit code in one pass, and a 512-entry
+    table tells which codes any interval accepts. As with the erosions of
+    supgen, pixels outside f satisfy both fg and bg.
+    """
+    from numpy import asarray, newaxis, zeros, arange, uint16, concatenate
+    f = asarray(f)
+    shape = f.shape
+    if len(shape) == 1: f = f[newaxis,:]
+    h,w = f.shape
+    fp = zeros((h+2,w+2), uint16)
+    fp[1:-1,1:-1] = f
+    code = zeros((h,w), uint16)
+    for k in xrange(9):
+        code |= fp[k//3:k//3+h, k%3:k%3+w] << k
+    c = arange(512)
+    table = zeros(512, bool)
+    for fg,bg in intervals:
+        table |= ((c & fg) == fg) & ((c & bg) == 0)
+    y = table[code]
+    r = concatenate([zeros(w,int), zeros(w,int)+h-1, arange(h), arange(h)])
+    cc = concatenate([arange(w), arange(w), zeros(h,int), zeros(h,int)+w-1])
+    out = 0                                 # the frame sees outside pixels
+    for k in xrange(9):
+        dr,dc = k//3 - 1, k%3 - 1
+        out = out | (((r+dr < 0) | (r+dr >= h) | (cc+dc < 0) | (cc+dc >= w)) << k)
+    code = code[r,cc].astype(int)
+    hit = zeros(len(r), bool)
+    for fg,bg in intervals:
+        hit |= (((code | out) & fg) == fg) & ((code & ~out & bg) == 0)
+    y[r,cc] = hit
+    return y.reshape(shape)
+
+
 def suprec(f, g, Bc=None):
     """
         - Purpose
@@ -4538,11 +5900,15 @@ def suprec(f, g, Bc=None):
             suprec creates the image y by an infinite number of recursive
             iterations (iterations until stability) of the erosion of f by
             Bc conditioned to g . We say that y is the sup-reconstruction of
-            g from the marker f .
+            g from the marker f . With a flat Bc, the hybrid algorithm of
+            Vinc:93b is used: a raster scan, an anti-raster scan and a FIFO
+            queue.
 
     """
     from numpy import product
     if Bc is None: Bc = secross()
+    if isbinary(Bc) and (f.dtype == g.dtype):
+        return _hybridrec(f, g, Bc, 1)
     n = product(f.shape)
     y = cerode(f,g,Bc,n);
     return y
@@ -4646,7 +6012,10 @@ def swatershed(f, g, B=None, LINEREG="LINES"):
             internally. According to the flag LINEREG y will be a labeled
             image of the catchment basins domain or just a binary image that
             presents the watershed lines. The implementation of this
-            function is based on LotuFalc:00 .
+            function is based on LotuFalc:00 : the cost of a path is its
+            largest step |f(p)-f(q)| between neighbours along B , and the
+            markers grow through a priority queue that only holds the
+            frontier pixels, in increasing order of cost.
         - Examples
             #
             f = to_uint8([
@@ -4665,11 +6034,23 @@ def swatershed(f, g, B=None, LINEREG="LINES"):
                 [0,  0,  0,  2,  0,  0,  0]])
             print swatershed(f,m,secross(),'REGIONS')
     """
-
+    from string import upper
+    from numpy import asarray, newaxis
     if B is None: B = secross()
-    print 'Not implemented yet'
-    return None
-    return y
+    LINEREG = upper(LINEREG).strip()
+    assert LINEREG in ['LINES','REGIONS'],'LINEREG should be LINES or REGIONS'
+    if isbinary(g):
+        g = label(g,B)
+    f,g = asarray(f),asarray(g)
+    shape = f.shape
+    if len(f.shape) == 1: f = f[newaxis,:]
+    if len(g.shape) == 1: g = g[newaxis,:]
+    x,v = mat2set(binary(B))
+    offsets = [(dr,dc) for dr,dc in x if dr or dc]
+    y,line = _cwshed(f, g, offsets, LINEREG == 'LINES', arcs=True)
+    if LINEREG == 'LINES':
+        return binary(line).reshape(shape)
+    return y.reshape(shape)
 
 
 def symdif(f1, f2):
@@ -4705,7 +6086,11 @@ def symdif(f1, f2):
             show(d)
             show(e)
     """
+    from numpy import bitwise_xor
 
+    p = _anypacked(f1, f2)
+    if p is not None:
+        return _packedop(bitwise_xor, _topacked(f1, p), f2)
     y = union(subm(f1,f2),subm(f2,f1))
     return y
 
@@ -4733,7 +6118,8 @@ def thick(f, Iab=None, n=-1, theta=45, DIRECTION="CLOCKWISE"):
             is n and each iteration is performed by union of f with the
             points that are detected in f by the hit-miss operators
             characterized by rotations of theta degrees of the interval Iab
-            .
+            . As in thin , flat 3x3 rotations are only tested again next to
+            the pixels that changed.
 
     """
     from numpy import product
@@ -4742,12 +6128,16 @@ def thick(f, Iab=None, n=-1, theta=45, DIRECTION="CLOCKWISE"):
     DIRECTION = upper(DIRECTION)            
     assert isbinary(f),'f must be binary image'
     if n == -1: n = product(f.shape)
+    rots = [interot(Iab, t, DIRECTION) for t in xrange(0,360,theta)]
+    bits = [_hmtbits(A, Bc) for A,Bc in rots]
+    if all(bits) and not isinstance(f, PackedBinary):
+        return _thinning(f, None, bits, n, 'thick')
     y = f
     zero = intersec(f,0)
     for i in xrange(n):
         aux = zero
-        for t in xrange(0,360,theta):
-            sup = supgen( y, interot(Iab, t, DIRECTION))
+        for Irot in rots:
+            sup = supgen( y, Irot)
             aux = union( aux, sup)
             y = union( y, sup)
         if isequal(aux,zero): break
@@ -4778,7 +6168,10 @@ def thin(f, Iab=None, n=-1, theta=45, DIRECTION="CLOCKWISE"):
             are detect in f by hit-miss operators characterized by rotations
             of theta of the interval Iab . When n is infinite and the
             interval is homothin (default conditions), thin gives the
-            skeleton by thinning.
+            skeleton by thinning. When all the rotations of Iab are flat
+            3x3 intervals, a rotation is tested again only on the pixels
+            next to those changed since it was last applied, so the cost
+            follows the number of removed pixels.
         - Examples
             #
             f=readgray('scissors.tif')
@@ -4793,18 +6186,84 @@ def thin(f, Iab=None, n=-1, theta=45, DIRECTION="CLOCKWISE"):
     DIRECTION = upper(DIRECTION)            
     assert isbinary(f),'f must be binary image'
     if n == -1: n = product(f.shape)
+    rots = [interot(Iab, t, DIRECTION) for t in xrange(0,360,theta)]
+    bits = [_hmtbits(A, Bc) for A,Bc in rots]
+    if all(bits) and not isinstance(f, PackedBinary):
+        return _thinning(f, None, bits, n, 'thin')
     y = f
     zero = intersec(f,0)
     for i in xrange(n):
         aux = zero
-        for t in xrange(0,360,theta):
-            sup = supgen( y, interot(Iab, t, DIRECTION))
+        for Irot in rots:
+            sup = supgen( y, Irot)
             aux = union( aux, sup)
             y = subm( y, sup)
         if isequal(aux,zero): break
     return y
 
 
+def _thinning(f, g, intervals, n, mode):
+    """
+    y = _thinning(f, g, intervals, n, mode)
+
+    thin, thick, cthin or cthick ( mode ) of the binary image f , with the
+    conditioning image g for the last two, by the 3x3 intervals given as
+    _hmtbits masks and applied one after the other, at most n rounds. An
+    interval is tested again only on the pixels next to a change made
+    since it was last applied; the other pixels keep their last answer.
+    """
+    from numpy import asarray, newaxis, zeros, empty, arange, flatnonzero, concatenate, where, uint16
+    from collections import deque
+    f = asarray(f)
+    shape = f.shape
+    if len(shape) == 1: f = f[newaxis,:]
+    grid = _Grid(f.shape, [(k//3 - 1, k%3 - 1) for k in xrange(9)])
+    y = grid.pad(f, 0, bool)
+    inside = grid.inside()
+    gp = grid.pad(0, 0, bool)
+    if g is not None:
+        gp = grid.pad(asarray(g).reshape(f.shape) != 0, 0, bool)
+    o = grid.o
+    pixels = flatnonzero(inside)
+    out = zeros(grid.size, uint16)          # neighbours outside f match both masks
+    for k in xrange(9):
+        out[pixels] |= (~inside[pixels + o[k]]).astype(uint16) << k
+    matched = [zeros(grid.size, bool) for fg,bg in intervals]
+    count = [0]*len(intervals)
+    tag = empty(grid.size, int)
+    recent = deque(maxlen=len(intervals))   # the changes since each interval was applied
+    for i in xrange(n):
+        moved = False
+        for t,(fg,bg) in enumerate(intervals):
+            if i == 0:
+                p = pixels
+            else:
+                p = concatenate(list(recent))
+                p = (p[:,newaxis] + o).ravel()
+                p = p[inside[p]]
+                tag[p] = arange(len(p))
+                p = p[tag[p] == arange(len(p))]
+            code = zeros(len(p), int)
+            for k in xrange(9):
+                code |= y[p + o[k]].astype(int) << k
+            b = out[p]
+            new = (((code | b) & fg) == fg) & ((code & ~b & bg) == 0)
+            count[t] += new.sum() - matched[t][p].sum()
+            matched[t][p] = new
+            yp = y[p]
+            if mode == 'thin':    ny = yp & ~new
+            elif mode == 'thick': ny = yp | new
+            elif mode == 'cthin': ny = where(new, gp[p], yp | gp[p])
+            else:                 ny = where(new, gp[p], yp & gp[p])
+            p = p[ny != yp]
+            y[p] = ~y[p]
+            recent.append(p)
+            if mode in ['thin','thick']: moved = moved or count[t] > 0
+            else: moved = moved or len(p) > 0
+        if not moved: break
+    return grid.crop(y).reshape(shape)
+
+
 def union(f1, f2, f3=None, f4=None, f5=None):
     """
         - Purpose
@@ -4866,8 +6325,14 @@ def union(f1, f2, f3=None, f4=None, f5=None):
             show(i)
             show(j)
     """
-    from numpy import maximum
+    from numpy import maximum, bitwise_or
 
+    p = _anypacked(f1, f2, f3, f4, f5)
+    if p is not None:
+        y = _topacked(f1, p)
+        for fi in (f2,f3,f4,f5):
+            if fi is not None: y = _packedop(bitwise_or, y, fi)
+        return y
     y = maximum(f1,f2)
     if f3: y = maximum(y,f3)
     if f4: y = maximum(y,f4)
@@ -4895,7 +6360,9 @@ def watershed(f, Bc=None, LINEREG="LINES"):
             Bc . According to the flag LINEREG y will be a labeled image of
             the catchment basins domain or just a binary image that presents
             the watershed lines. The implementation of this function is
-            based on VincSoil:91 .
+            based on VincSoil:91 . For a symmetric flat Bc , the regional
+            minima are found as the flat zones with no lower neighbour, and
+            their labels feed the hierarchical queue of cwatershed directly.
         - Examples
             #
             f=readgray('astablet.tif')
@@ -4907,9 +6374,28 @@ def watershed(f, Bc=None, LINEREG="LINES"):
             lblshow(w2)
     """
     from string import upper
+    from numpy import asarray, newaxis, ones, zeros, cumsum
     if Bc is None: Bc = secross()
-    return cwatershed(f,regmin(f,Bc),upper(LINEREG))
-    return y
+    LINEREG = upper(LINEREG).strip()
+    offsets = _symoffsets(Bc)
+    if offsets is None:
+        return cwatershed(f, regmin(f,Bc), Bc, LINEREG)
+    assert LINEREG in ['LINES','REGIONS'],'LINEREG should be LINES or REGIONS'
+    f = asarray(f)
+    shape = f.shape
+    if len(shape) == 1: f = f[newaxis,:]
+    z = _labelcc(f, ones(f.shape, bool), offsets, lambda a,b: a == b)
+    top = limits(f)[1]
+    up = zeros(z.max()+1, bool)             # flat zones with a lower neighbour
+    for dr,dc in offsets:
+        q = _translate(_translate(f, -dr, top).T, -dc, top).T
+        up[z[q < f]] = 1
+    up[0] = 1
+    minima = cumsum(~up) * ~up
+    y,line = _cwshed(f, minima[z], offsets, LINEREG == 'LINES')
+    if LINEREG == 'LINES':
+        return binary(line).reshape(shape)
+    return y.astype(z.dtype).reshape(shape)
 
 
 def bench(count=10):
@@ -5269,6 +6755,359 @@ def pad4n(f, Bc, value, scale=1):
     return y
 
 
+class _Grid(object):
+    """
+    g = _Grid(shape, offsets)
+
+    Raveled layout of an image of the given shape inside a frame wide
+    enough for the neighbour offsets (dr, dc, ...), so that p + g.o[i] is
+    a valid index for every image pixel p . pad copies an image into the
+    layout, view and crop take it back out, inside marks the image pixels
+    and pixels lists them in raster order.
+    """
+
+    def __init__(self, shape, offsets):
+        h,w = shape
+        self.shape = h,w
+        self.mh = max([abs(x[0]) for x in offsets] + [0])
+        self.mw = max([abs(x[1]) for x in offsets] + [0])
+        self.H,self.W = h + 2*self.mh, w + 2*self.mw
+        self.size = self.H*self.W
+        self.o = [x[0]*self.W + x[1] for x in offsets]
+
+    def pad(self, f, fill=0, dtype=None):
+        from numpy import asarray, empty
+        f = asarray(f)
+        y = empty(self.size, dtype or f.dtype)
+        y[:] = fill
+        self.view(y)[:] = f
+        return y
+
+    def view(self, y, dr=0, dc=0):
+        h,w = self.shape
+        r,c = self.mh + dr, self.mw + dc
+        return y.reshape(self.H,self.W)[r:r+h, c:c+w]
+
+    def crop(self, y):
+        return self.view(y).copy()
+
+    def inside(self):
+        from numpy import ones
+        return self.pad(ones(self.shape, bool), 0)
+
+    def index(self, i, j):
+        return (i + self.mh)*self.W + j + self.mw
+
+    def pixels(self):
+        from numpy import arange, newaxis
+        h,w = self.shape
+        return self.index(arange(h)[:,newaxis], arange(w)[newaxis,:]).ravel()
+
+
+class PackedBinary(object):
+    """
+        - Purpose
+            Bit-packed binary image.
+        - Synopsis
+            p = PackedBinary(f)
+        - Input
+            f: Binary image.
+        - Output
+            p: Packed binary image.
+        - Description
+            PackedBinary stores the binary image f with 64 pixels per
+            uint64 word along the rows. dilate, erode, neg, union,
+            intersec, subm, symdif, isequal (and therefore supgen,
+            supcanon, thin, thick, cthin and cthick) accept packed images
+            and compute their result with shifts and bitwise operations on
+            whole words, returning a packed image. When one operand is
+            packed, the binary images and constants given with it are
+            packed too. Morphology on packed
+            images moves 8 times less memory than on binary images. Use
+            p.tobinary() to get back the (identical) binary image. Only
+            flat structuring elements are supported.
+        - Examples
+            #
+            f=readgray('pcbholes.tif')
+            p=PackedBinary(f)
+            g=thin(p).tobinary()
+            show(f,g)
+    """
+    def __init__(self, f):
+        from numpy import asarray, newaxis, zeros, uint8, uint64, packbits, ascontiguousarray
+        f = asarray(f)
+        assert isbinary(f),'f must be binary image'
+        if len(f.shape) == 1: f = f[newaxis,:]
+        h,w = f.shape
+        nw = -(-w//64)
+        bits = zeros((h,nw*64),uint8)
+        bits[:,:w] = f
+        bits = bits.reshape(h,nw*8,8)[:,:,::-1]      # first pixel in the lsb
+        octets = ascontiguousarray(packbits(bits,axis=2).reshape(h,nw*8))
+        self.words = octets.view('<u8').astype(uint64)
+        self.shape = (h,w)
+        self.dtype = f.dtype
+
+    def tobinary(self):
+        """
+        f = p.tobinary()
+
+        Unpack into a binary image.
+        """
+        from numpy import uint8, unpackbits, ascontiguousarray
+        h,w = self.shape
+        octets = ascontiguousarray(self.words.astype('<u8')).view(uint8)
+        bits = unpackbits(octets.reshape(h,-1,1),axis=2)[:,:,::-1]
+        return bits.reshape(h,-1)[:,:w].astype(bool)
+
+
+def _packed(words, shape):
+    """
+    p = _packed(words, shape)
+
+    Build a PackedBinary from its words. The bits beyond the image width
+    must be zero.
+    """
+    from numpy import dtype
+    p = PackedBinary.__new__(PackedBinary)
+    p.words = words
+    p.shape = shape
+    p.dtype = dtype(bool)
+    return p
+
+
+def _packmask(p):
+    """
+    mask = _packmask(p)
+
+    Word mask with the bits that hold pixels of p set.
+    """
+    from numpy import empty, uint64
+    nw = p.words.shape[1]
+    mask = empty(nw,uint64)
+    mask[:] = uint64(0xFFFFFFFFFFFFFFFF)
+    r = p.shape[1] % 64
+    if nw and r:
+        mask[-1] = uint64((1 << r) - 1)
+    return mask
+
+
+def _topacked(f, p):
+    """
+    y = _topacked(f, p)
+
+    Convert f, a packed image, a binary image or the constants 0 or 1, to
+    a packed image with the shape of the packed image p.
+    """
+    from numpy import asarray, zeros_like
+    if isinstance(f, PackedBinary):
+        y = f
+    else:
+        f = asarray(f)
+        if f.shape == ():
+            if f: y = _packed(zeros_like(p.words) | _packmask(p), p.shape)
+            else: y = _packed(zeros_like(p.words), p.shape)
+        else:
+            y = PackedBinary(f)
+    assert y.shape == p.shape,'images must have the same shape'
+    return y
+
+
+def _anypacked(*fs):
+    """
+    p = _anypacked(*fs)
+
+    The first packed image among fs , or None when there is none.
+    """
+    for f in fs:
+        if isinstance(f, PackedBinary): return f
+    return None
+
+
+def _packedop(op, f1, f2):
+    """
+    y = _packedop(op, f1, f2)
+
+    Apply the bitwise ufunc op to the packed image f1 and to f2 (see
+    _topacked).
+    """
+    return _packed(op(f1.words,_topacked(f2, f1).words), f1.shape)
+
+
+def _packedshift(p, dr, dc, fill):
+    """
+    words = _packedshift(p, dr, dc, fill)
+
+    Words of the packed image p translated by (dr,dc): y(i,j) = p(i-dr,j-dc),
+    with the value fill (0 or 1) for the pixels coming from outside p.
+    """
+    from numpy import empty_like, uint64
+    h,nw = p.words.shape
+    mask = _packmask(p)
+    if fill: fw = uint64(0xFFFFFFFFFFFFFFFF)
+    else:    fw = uint64(0)
+    t = p.words
+    if fill: t = t | ~mask                  # padding bits behave as outside
+    if dc and nw:
+        q,r = divmod(abs(dc),64)
+        q = min(q,nw)
+        s = empty_like(t)
+        if dc > 0:                          # towards higher columns
+            s[:,:q] = fw
+            s[:,q:] = t[:,:nw-q]
+            if r:
+                prev = empty_like(s)
+                prev[:,0] = fw
+                prev[:,1:] = s[:,:-1]
+                s = (s << uint64(r)) | (prev >> uint64(64-r))
+        else:
+            s[:,nw-q:] = fw
+            s[:,:nw-q] = t[:,q:]
+            if r:
+                nxt = empty_like(s)
+                nxt[:,-1] = fw
+                nxt[:,:-1] = s[:,1:]
+                s = (s >> uint64(r)) | (nxt << uint64(64-r))
+        t = s
+    if dr:
+        s = empty_like(t)
+        s[:] = fw
+        if dr > 0:
+            if dr < h: s[dr:] = t[:h-dr]
+        elif -dr < h:
+            s[:h+dr] = t[-dr:]
+        t = s
+    return t & mask
+
+
+def _packeddilate(p, b):
+    """
+    y = _packeddilate(p, b)
+
+    Dilation of the packed image p by the flat structuring element b: the
+    union of the translations of p by the offsets of b.
+    """
+    from numpy import zeros_like
+    assert isbinary(b),'packed images only accept flat structuring elements'
+    x,v = mat2set(b)
+    y = zeros_like(p.words)
+    for i in xrange(len(x)):
+        y |= _packedshift(p, x[i,0], x[i,1], 0)
+    return _packed(y, p.shape)
+
+
+def _packederode(p, b):
+    """
+    y = _packederode(p, b)
+
+    Erosion of the packed image p by the flat structuring element b: the
+    intersection of the translations of p by the reflected offsets of b.
+    """
+    from numpy import zeros_like
+    assert isbinary(b),'packed images only accept flat structuring elements'
+    x,v = mat2set(b)
+    y = zeros_like(p.words) | _packmask(p)
+    for i in xrange(len(x)):
+        y &= _packedshift(p, -x[i,0], -x[i,1], 1)
+    return _packed(y, p.shape)
+
+
+class ComponentTree(object):
+    """
+        - Purpose
+            Component tree (max-tree or min-tree) of a gray-scale image.
+        - Synopsis
+            t = ComponentTree(f, Bc=None, dual=False)
+        - Input
+            f:    Gray-scale (uint8 or uint16) image.
+            Bc:   Structuring Element Default: None (3x3 elementary cross).
+                  Flat, symmetric connectivity.
+            dual: Default: False. Build the min-tree instead of the
+                  max-tree.
+        - Output
+            t: Component tree.
+        - Description
+            The nodes of the max-tree (min-tree) of f are the connected
+            components of its upper (lower) threshold sets at the gray
+            levels present in f . For each node n the tree holds
+            t.parent[n] (n itself at a root; parents come after their
+            children), t.level[n], t.area[n], t.volume[n] (number of
+            pixel-levels from level[n] up to f , inclusive), t.height[n]
+            (distance from level[n] to the extremum of f in the
+            component), t.mean[n] (mean of f in the component) and
+            t.bbox[n] (first column, first row, last column, last row).
+            t.pnode gives the node of each pixel at its own level. The tree
+            is built once and can be filtered at any threshold with one
+            vectorised pass over the nodes. areaopen , hmax and patspec
+            accept a max-tree; areaclose , hmin and patspec accept a
+            min-tree. Trees can be pickled.
+        - Examples
+            #
+            f=readgray('bloodcells.tif')
+            t=ComponentTree(f)
+            for a in [50,100,200,400]:
+                show(areaopen(t,a))
+            show(t.filter(t.volume >= 5000))
+    """
+    def __init__(self, f, Bc=None, dual=False):
+        from numpy import asarray
+        if Bc is None: Bc = secross()
+        f = asarray(f)
+        offsets = _symoffsets(Bc)
+        assert offsets is not None,'Bc must be a flat and symmetric connectivity'
+        assert datatype(f) in ('uint8', 'uint16'),'f must be a uint8 or uint16 image'
+        parent, level, pnode, area, vsum, top, box = _maxtree(f, offsets, dual)
+        sign = dual and -1 or 1
+        self.dual = bool(dual)
+        self.dtype = f.dtype
+        self.shape = pnode.shape
+        self.pnode = pnode
+        self.parent = parent
+        self.level = level
+        self.area = area
+        self.volume = sign*(vsum - level*area) + area
+        self.height = sign*(top - level)
+        self.mean = vsum / area
+        self.bbox = box[[1,0,3,2]].T
+
+    def reconstruct(self, v):
+        """
+        y = t.reconstruct(v)
+
+        Image where each pixel takes the maximum (minimum for a min-tree)
+        of the node values v over its node and the ancestors of that node.
+        """
+        sign = self.dual and -1 or 1
+        y = sign*_pathmax(self.parent, sign*v)
+        return y.astype(self.dtype)[self.pnode]
+
+    def filter(self, keep):
+        """
+        y = t.filter(keep)
+
+        Connected filter keeping the nodes where keep is true: each pixel
+        takes the level of its deepest kept node, or the infimum (supremum
+        for a min-tree) of the datatype when none is kept. keep must be
+        an increasing criterion, true at the parent of every kept node, as
+        t.area >= a or t.volume >= v are.
+        """
+        from numpy import where
+        return self.reconstruct(where(keep, self.level, limits(self)[int(self.dual)]))
+
+    def areaspec(self):
+        """
+        h = t.areaspec()
+
+        Area pattern spectrum: h[a-1] is the volume removed between the
+        area filters of sizes a and a+1.
+        """
+        from numpy import bincount, arange
+        k = limits(self)[int(self.dual)]
+        lp = self.level[self.parent]
+        lp[self.parent == arange(len(self.parent))] = k
+        return bincount(self.area, abs(self.level - lp)*self.area)[1:].astype(int)
+
+
 __figs__ = [None]
 
 def plot(plotitems=[], options=[], outfig=-1, filename=None):